@@ -5,6 +5,7 @@ values.
 
 History:
     12.02.2016. First Implementation.
+    18.10.2026. Each run starts with its own P and from its previous state.
 
 @author: Mario Garcia
 www.mayitzin.com
@@ -56,7 +57,6 @@ r = y + s
 # Static elements of KF
 z = r.reshape((1,n))
 A = np.array([[1.0]])
-P = np.array([[1.0]])
 H = np.array([[1.0]])
 
 # Variable elements of KF
@@ -68,7 +68,11 @@ xhat = np.zeros((m*m,n))
 j = 0
 for Q in sigmas:
     for R in sigmas:
-        for i in range(n): xhat[j,i], P = kf(xhat[j,i].flatten(), z[:,i], A, P, Q, R, H)
+        # Every run starts from the same state and covariance
+        xk, P = np.zeros(1), np.array([[1.0]])
+        for i in range(n):
+            xk, P = kf(xk, z[:,i], A, P, Q, R, H)
+            xhat[j,i] = xk[0,0]
         j+=1
 
 for i in range(m*m):
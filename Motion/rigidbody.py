@@ -17,12 +17,25 @@ History:
     19.03.2016. Added Madwicks' Algorithm.
     27.07.2018. Modified Madgwick's Algorithm and initial pose estimation.
                 Add cosine and sine functions for degrees.
+    18.10.2026. Batch versions of Madgwick's Algorithm for whole logs.
+                Added AHRSFleet to update many devices at once.
+                Added stateful MahonyFilter with persistent integral term.
+                Rotation conversions over arrays of rotations.
+                Added QuaternionArray.
+                Added SLERP resampling of Quaternions.
+                Homogeneous transformations over arrays and chains of them.
+                Added matrix of chordal distances and RotationIndex.
+                Added chordal averaging of rotations.
+                Initial pose estimation over arrays and stationary windows.
 
 @author: Mario Garcia
 """
 
+import math
+import time
 import numpy as np
 import scipy.linalg as lin
+from scipy.spatial import cKDTree
 import platform
 
 # Check OS
@@ -42,12 +55,17 @@ def sind(deg):
     return np.sin(deg*deg2rad)
 
 
-def rotate(ex,ey,ez):
+def rotate(ex,ey,ez,out=None):
     """rotate creates a 3-by-3 rotation matrix R in SO(3) with the common
     sequence xyz created by multiplying three rotation matrices of the form:
         R = Rz(ez)*Ry(ey)*Rx(ex)
     where ex, ey and ez are given in degrees.
+
+    If the angles are N-vectors, an N-by-3-by-3 array with one rotation
+    matrix per triplet of angles is returned (or written into out).
     """
+    if np.ndim(ex) > 0 or out is not None:
+        return _rotateArray(ex, ey, ez, out)
     # Convert from degrees to radians
     ex *= deg2rad
     ey *= deg2rad
@@ -59,46 +77,67 @@ def rotate(ex,ey,ez):
     return np.dot(Rz,np.dot(Ry,Rx))
 
 
+def _rotateArray(ex, ey, ez, out=None):
+    """_rotateArray builds the product Rz*Ry*Rx of N triplets of Euler
+    angles (in degrees) element-wise into an N-by-3-by-3 array.
+    """
+    ex = np.asarray(ex, dtype=float)*deg2rad
+    ey = np.asarray(ey, dtype=float)*deg2rad
+    ez = np.asarray(ez, dtype=float)*deg2rad
+    if out is None:
+        out = np.empty(np.broadcast(ex, ey, ez).shape + (3,3))
+    cx, sx = np.cos(ex), np.sin(ex)
+    cy, sy = np.cos(ey), np.sin(ey)
+    cz, sz = np.cos(ez), np.sin(ez)
+    out[...,0,0] = cz*cy
+    out[...,0,1] = cz*sy*sx - sz*cx
+    out[...,0,2] = cz*sy*cx + sz*sx
+    out[...,1,0] = sz*cy
+    out[...,1,1] = sz*sy*sx + cz*cx
+    out[...,1,2] = sz*sy*cx - cz*sx
+    out[...,2,0] = -sy
+    out[...,2,1] = cy*sx
+    out[...,2,2] = cy*cx
+    return out
+
+
 def am2q(a=[], m=[], rtype='q'):
     """am2q naively computes the pose of the device based on the acceleration
     forces sensed along each axis. Additionally, a triaxial magnetometer can be
     used.
+
+    Given N-by-3 arrays of accelerometer (and magnetometer) samples, the poses
+    of all samples are computed at once and returned as an N-by-4 array of
+    Quaternions, or an N-by-3 array of Euler angles in degrees if rtype is
+    not 'q'. The given arrays are not modified.
     """
-    acx, acy, acz = a[0], a[1], a[2]
-    # Get norm of acceleration vector
-    acn = np.sqrt(acx**2 + acy**2 + acz**2)
-    # Normalize values
-    acx /= acn
-    acy /= acn
-    acz /= acn
+    a = np.asarray(a, dtype=float)
+    single = a.ndim == 1
+    a = a.reshape((-1,3))
+    # Normalize acceleration vectors
+    a = a / np.sqrt(np.sum(a*a, axis=1))[:,None]
+    acx, acy, acz = a[:,0], a[:,1], a[:,2]
     # Estimate Roll and Pitch angles (Yaw is equal to Zero)
     ex = np.arctan2( acy, acz)
     ey = np.arctan2(-acx, np.sqrt(acy**2 + acz**2))
-    ez = 0
+    ez = np.zeros_like(ex)
     # Euler to Quaternion
     cx2 = np.cos(ex/2.0)
     sx2 = np.sin(ex/2.0)
     cy2 = np.cos(ey/2.0)
     sy2 = np.sin(ey/2.0)
-    qrw =  cx2*cy2
-    qrx =  sx2*cy2
-    qry =  cx2*sy2
-    qrz = -sx2*sy2
+    q = np.column_stack((cx2*cy2, sx2*cy2, cx2*sy2, -sx2*sy2))
     # Normalize reference Quaternion
-    invsqrt = np.sqrt(qrw**2 + qrx**2 + qry**2 + qrz**2)
-    qw = qrw / invsqrt
-    qx = qrx / invsqrt
-    qy = qry / invsqrt
-    qz = qrz / invsqrt
+    q /= np.sqrt(np.sum(q*q, axis=1))[:,None]
     # Compass values were also provided (to get heading value)
-    if len(m)>2:
-        mx, my, mz = m[0], m[1], m[2]
+    m = np.asarray(m, dtype=float)
+    if m.size > 2:
+        m = m.reshape((-1,3))
         # Normalize magnetometer measurements
-        invsqrt = np.sqrt(mx**2 + my**2 + mz**2)
-        mx /= invsqrt
-        my /= invsqrt
-        mz /= invsqrt
+        m = m / np.sqrt(np.sum(m*m, axis=1))[:,None]
+        mx, my, mz = m[:,0], m[:,1], m[:,2]
         # Auxiliary variables to save computation
+        qw, qx, qy, qz = q[:,0], q[:,1], q[:,2], q[:,3]
         qw2 = qw*qw
         qx2 = qx*qx
         qy2 = qy*qy
@@ -111,49 +150,168 @@ def am2q(a=[], m=[], rtype='q'):
         # Build final Quaternion
         cz2 = np.cos(ez/2.0)
         sz2 = np.sin(ez/2.0)
-        qw = cx2*cy2*cz2 + sx2*sy2*sz2
-        qx = sx2*cy2*cz2 - cx2*sy2*sz2
-        qy = cx2*sy2*cz2 + sx2*cy2*sz2
-        qz = cx2*cy2*sz2 - sx2*sy2*cz2
+        q = np.column_stack((cx2*cy2*cz2 + sx2*sy2*sz2,
+                             sx2*cy2*cz2 - cx2*sy2*sz2,
+                             cx2*sy2*cz2 + sx2*cy2*sz2,
+                             cx2*cy2*sz2 - sx2*sy2*cz2))
         # Normalize quaternion
-        invsqrt = np.sqrt(qw**2 + qx**2 + qy**2 + qz**2)
-        qw /= invsqrt
-        qx /= invsqrt
-        qy /= invsqrt
-        qz /= invsqrt
+        q /= np.sqrt(np.sum(q*q, axis=1))[:,None]
     # Return desired values (Quaterion or Euler Angles)
     if rtype=='q':
-        return [qw, qx, qy, qz]
+        out = q
     else:
         # Convert Radians to Euler Angles
-        ex *= rad2deg
-        ey *= rad2deg
-        ez *= rad2deg
-        return [ex, ey, ez]
+        out = np.column_stack((ex, ey, ez))*rad2deg
+    return out[0].tolist() if single else out
 
 
-def q2R(q=[1,0,0,0]):
+def am2qWindows(a, m=[], rtype='q', window=100, threshold=0.01, g=None, g_threshold=0.05):
+    """am2qWindows estimates the initial pose of the device in each window of
+    the log where it stays still.
+
+    The N-by-3 accelerometer array a is split in consecutive windows of the
+    given length. A window is stationary when the relative standard deviation
+    of the acceleration norm is below threshold (and, if the gyroscope array
+    g is given, when the mean angular rate norm is below g_threshold). The
+    accelerometer and magnetometer samples of every stationary window are
+    averaged and am2q is solved once for all of them.
+
+    It returns the poses (as in am2q) and the index of the first sample of
+    each stationary window.
+    """
+    a = np.asarray(a, dtype=float)
+    W = a.shape[0] // window
+    A = a[:W*window].reshape((W,window,3))
+    # Detect stationary windows
+    norms = np.sqrt(np.sum(A*A, axis=2))
+    still = np.std(norms, axis=1) < threshold*np.mean(norms, axis=1)
+    if g is not None:
+        G = np.asarray(g, dtype=float)[:W*window].reshape((W,window,3))
+        still &= np.mean(np.sqrt(np.sum(G*G, axis=2)), axis=1) < g_threshold
+    starts = np.flatnonzero(still)*window
+    if len(starts) < 1:
+        return np.empty((0, 4 if rtype=='q' else 3)), starts
+    # Average the measurements of each stationary window
+    a_mean = np.mean(A[still], axis=1)
+    m = np.asarray(m, dtype=float)
+    m_mean = np.mean(m[:W*window].reshape((W,window,3))[still], axis=1) if m.size > 2 else []
+    return am2q(a_mean, m_mean, rtype), starts
+
+
+def q2R(q=[1,0,0,0], out=None):
     """
     q2R builds a rotation matrix R in SO(3) from a given Quaternion q of
     the form q = [q_w, q_x, q_y, q_z].
     The default value is the Quaternion q=[1,0,0,0] that produces a
     3-by-3 Identity matrix.
+
+    If q is an N-by-4 array, an N-by-3-by-3 array with one rotation matrix
+    per quaternion is returned (or written into out).
     """
+    if np.ndim(q) > 1 or out is not None:
+        q = np.asarray(q, dtype=float)
+        if out is None:
+            out = np.empty(q.shape[:-1] + (3,3))
+        qw, qx, qy, qz = q[...,0], q[...,1], q[...,2], q[...,3]
+        out[...,0,0] = 1.0-2.0*(qy*qy+qz*qz)
+        out[...,0,1] = 2.0*(qx*qy-qw*qz)
+        out[...,0,2] = 2.0*(qx*qz+qw*qy)
+        out[...,1,0] = 2.0*(qx*qy+qw*qz)
+        out[...,1,1] = 1.0-2.0*(qx*qx+qz*qz)
+        out[...,1,2] = 2.0*(qy*qz-qw*qx)
+        out[...,2,0] = 2.0*(qx*qz-qw*qy)
+        out[...,2,1] = 2.0*(qw*qx+qy*qz)
+        out[...,2,2] = 1.0-2.0*(qx*qx+qy*qy)
+        return out
     return np.array([
         [  1-2*(q[2]**2+q[3]**2),    2*(q[1]*q[2]-q[0]*q[3]),  2*(q[1]*q[3]+q[0]*q[2])  ],
         [  2*(q[1]*q[2]+q[0]*q[3]),  1-2*(q[1]**2+q[3]**2),    2*(q[2]*q[3]-q[0]*q[1])  ],
         [  2*(q[1]*q[3]-q[0]*q[2]),  2*(q[0]*q[1]+q[2]*q[3]),  1-2*(q[1]**2+q[2]**2)    ]])
 
 
-def hmtrans(R,t):
+def R2q(R=np.eye(3), eta=0.0, out=None):
+    """
+    R2q obtains the Quaternions of an N-by-3-by-3 array of rotation matrices
+    and returns them as an N-by-4 array (or writes them into out).
+
+    The magnitude of each element is computed with the same branches of
+    Quaternion.fromR, chosen element-wise with masks, and the signs of the
+    vector part are recovered from the skew-symmetric part of R, so that
+    q2R(R2q(R)) == R with q_w >= 0.
+
+    See Also
+    --------
+
+    - http://www.iri.upc.edu/files/scidoc/2068-Accurate-Computation-of-Quaternions-from-Rotation-Matrices.pdf
+    """
+    R = np.asarray(R, dtype=float)
+    if out is None:
+        out = np.empty(R.shape[:-2] + (4,))
+    # Get elements of R
+    r11, r12, r13 = R[...,0,0], R[...,0,1], R[...,0,2]
+    r21, r22, r23 = R[...,1,0], R[...,1,1], R[...,1,2]
+    r31, r32, r33 = R[...,2,0], R[...,2,1], R[...,2,2]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        # Compute qw
+        diag = r11+r22+r33
+        nom = (r32-r23)**2+(r13-r31)**2+(r21-r12)**2
+        out[...,0] = 0.5*np.sqrt(np.where(diag > eta, 1.0+diag, nom/(3.0-diag)))
+        # Compute qx
+        diag = r11-r22-r33
+        nom = (r32-r23)**2+(r12+r21)**2+(r31+r13)**2
+        out[...,1] = 0.5*np.sqrt(np.where(diag > eta, 1.0+diag, nom/(3.0-diag)))
+        # Compute qy
+        diag = -r11+r22-r33
+        nom = (r13-r31)**2+(r12+r21)**2+(r23+r32)**2
+        out[...,2] = 0.5*np.sqrt(np.where(diag > eta, 1.0+diag, nom/(3.0-diag)))
+        # Compute qz
+        diag = -r11-r22+r33
+        nom = (r21-r12)**2+(r31+r13)**2+(r32+r23)**2
+        out[...,3] = 0.5*np.sqrt(np.where(diag > eta, 1.0+diag, nom/(3.0-diag)))
+    # Recover signs of the vector part relative to the largest element
+    # (Shepperd's selection). If q_w is the largest one, the signs come from
+    # the skew-symmetric part of R. Otherwise the largest vector element is
+    # taken positive, the others get their signs from the symmetric part,
+    # and the whole vector is flipped with the sign of q_w, which is only
+    # uncertain near 180 degrees, where both signs give the same rotation.
+    def sgn(x):
+        return np.where(x < 0.0, -1.0, 1.0)
+    dx, dy, dz = sgn(r32-r23), sgn(r13-r31), sgn(r21-r12)
+    sxy, sxz, syz = sgn(r12+r21), sgn(r13+r31), sgn(r23+r32)
+    k = np.argmax(out, axis=-1)
+    sx = np.choose(k, [dx, dx, dy*sxy, dz*sxz])
+    sy = np.choose(k, [dy, dx*sxy, dy, dz*syz])
+    sz = np.choose(k, [dz, dx*sxz, dy*syz, dz])
+    out[...,1] *= sx
+    out[...,2] *= sy
+    out[...,3] *= sz
+    return out
+
+
+def hmtrans(R,t,out=None,compact=False):
     """
     hmtrans build the 4-by-4 homogeneous transformation matrix of the form:
         T = | R t |
             | 0 1 |
     where R is a 3-by-3 rotation matrix and t is the 3-translation vector.
+
+    Given an N-by-3-by-3 array of rotations and an N-by-3 array of
+    translations, it builds the N-by-4-by-4 array of transformations. With
+    compact=True the constant last row is dropped and N-by-3-by-4 arrays are
+    built instead. All the functions operating transformations accept both
+    forms.
     """
-    T = np.vstack((np.hstack((R,t)),np.array([0,0,0,1])))
-    return  T.astype(np.float)
+    R = np.asarray(R, dtype=float)
+    t = np.asarray(t, dtype=float)
+    lead = R.shape[:-2]
+    if out is None:
+        out = np.empty(lead + ((3 if compact else 4), 4))
+    out[...,:3,:3] = R
+    out[...,:3,3] = t.reshape(lead + (3,))
+    if out.shape[-2] == 4:
+        out[...,3,:3] = 0.0
+        out[...,3,3] = 1.0
+    return out
 
 
 def dchord(R1,R2):
@@ -171,16 +329,227 @@ def dchord(R1,R2):
     return np.sqrt(lin.norm(A, ord='fro'))
 
 
-def invTrans(T):
+def dchordMatrix(R1,R2=None,tile=2048,out=None):
+    """
+    dchordMatrix computes the chordal distances ||R1[i]-R2[j]||_F between
+    all rotations of the N-by-3-by-3 array R1 and the M-by-3-by-3 array R2
+    (R1 against itself if R2 is not given) as the N-by-M array D.
+
+    It uses the identity:
+        ||R1-R2||_F^2 = 6 - 2 tr(R1^T R2)
+    where the traces of all pairs are the product of the rotations flattened
+    to 9-vectors. The rows are computed in blocks of tile rotations to bound
+    the used memory.
+
+    Note that dchord(R1,R2) returns the square root of this distance.
+    """
+    X1 = np.asarray(R1, dtype=float).reshape((-1,9))
+    X2 = X1 if R2 is None else np.asarray(R2, dtype=float).reshape((-1,9))
+    if out is None:
+        out = np.empty((X1.shape[0], X2.shape[0]))
+    for i in range(0, X1.shape[0], tile):
+        D = out[i:i+tile]
+        np.dot(X1[i:i+tile], X2.T, out=D)
+        D *= -2.0
+        D += 6.0
+        np.maximum(D, 0.0, out=D)
+        np.sqrt(D, out=D)
+    return out
+
+
+class RotationIndex:
+    """
+    RotationIndex answers proximity queries over a large set of rotations
+    with their chordal distance, e.g. to search candidates of loop closures
+    or to remove duplicated keyframes.
+
+    The rotations are stored as unit Quaternions in a KD-tree. Since q and -q
+    are the same rotation both of them are inserted. The chordal distance d
+    of two rotations is related to the inner product of their Quaternions as:
+        d = 2*sqrt(2)*sqrt(1 - (q1.q2)^2)
+    and so to the euclidean distance between them.
+    """
+    def __init__(self, R):
+        q = self._quaternions(R)
+        self.N = q.shape[0]
+        self.tree = cKDTree(np.vstack((q, -q)))
+
+    def _quaternions(self, R):
+        R = np.asarray(R, dtype=float)
+        return R2q(R) if R.shape[-1] == 3 else R / np.sqrt(np.sum(R*R, axis=-1))[...,None]
+
+    def query(self, R, d):
+        """query returns the sorted indices of all the rotations whose
+        chordal distance to the rotation R (or Quaternion) is at most d.
+        """
+        q = self._quaternions(R)
+        # Minimum inner product of Quaternions and its euclidean distance
+        c = np.sqrt(max(1.0 - d*d/8.0, 0.0))
+        idx = self.tree.query_ball_point(q, np.sqrt(2.0-2.0*c)+1e-12)
+        return np.unique(np.asarray(idx, dtype=int) % self.N)
+
+    def nearest(self, R, k=1):
+        """nearest returns the chordal distances and indices of the k nearest
+        rotations to each of the M rotations (or Quaternions) in R, as two
+        M-by-k arrays.
+        """
+        q = self._quaternions(R).reshape((-1,4))
+        k = min(k, self.N)
+        _, idx = self.tree.query(q, k=2*k)
+        idx = idx % self.N
+        # Keep the first k distinct rotations of each query
+        I = np.empty((q.shape[0], k), dtype=int)
+        for j in range(q.shape[0]):
+            _, first = np.unique(idx[j], return_index=True)
+            I[j] = idx[j][np.sort(first)[:k]]
+        c = np.abs(np.einsum('mkj,mj->mk', self.tree.data[I], q))
+        return 2.0*np.sqrt(2.0)*np.sqrt(np.maximum(1.0-c*c, 0.0)), I
+
+
+def projectSO3(M):
+    """
+    projectSO3 finds the closest rotation matrix (in Frobenius norm) to the
+    3-by-3 matrix M, or to each matrix of an N-by-3-by-3 array, with its
+    Singular Value Decomposition M = U*S*V^T:
+        R = U * diag(1, 1, det(U*V^T)) * V^T
+    """
+    U, S, Vt = np.linalg.svd(M)
+    U[...,:,2] *= np.sign(np.linalg.det(np.matmul(U, Vt)))[...,None]
+    return np.matmul(U, Vt)
+
+
+def meanRotation(R, weights=None, groups=None, robust=None, delta=0.1, iterations=50, tol=1e-12):
+    """
+    meanRotation computes the chordal L2 mean of an N-by-3-by-3 array of
+    rotations (or N-by-4 array of Quaternions), which is the projection onto
+    SO(3) of their (weighted) sum.
+
+    Options:
+    - weights is an N-vector with the weight of each rotation.
+    - groups is an N-vector labeling the set of each rotation. Then all sets
+      are averaged at once and a G-by-3-by-3 array with the mean of each set
+      (in the order of the sorted labels) is returned.
+    - robust can be 'L1' or 'huber' to compute a robust mean with iteratively
+      reweighted means. The Huber loss is quadratic for chordal distances
+      below delta.
+
+    The output is given in the same form as the input (rotation matrices or
+    Quaternions).
+
+    See Also
+    --------
+    - http://users.cecs.anu.edu.au/~trumpf/pubs/Hartley_Trumpf_Dai_Li.pdf
+    """
+    R = np.asarray(R, dtype=float)
+    quaternions = R.shape[-1] == 4
+    if quaternions:
+        R = q2R(R)
+    X = R.reshape((-1,9))
+    N = X.shape[0]
+    w0 = np.ones(N) if weights is None else np.asarray(weights, dtype=float)
+    if groups is None:
+        labels, G = np.zeros(N, dtype=int), 1
+    else:
+        labels = np.unique(groups, return_inverse=True)[1].ravel()
+        G = labels.max()+1
+    # Weighted mean of the rotations of each group
+    def groupMean(w):
+        M = np.empty((G,9))
+        for k in range(9):
+            M[:,k] = np.bincount(labels, X[:,k]*w, minlength=G)
+        return projectSO3(M.reshape((G,3,3)))
+    mean = groupMean(w0)
+    if robust is not None:
+        if robust not in ['L1', 'huber']:
+            raise ValueError("Unknown robust loss '%s'" % robust)
+        for i in range(iterations):
+            # Chordal distance of each rotation to the mean of its group
+            d = np.sqrt(np.maximum(6.0-2.0*np.sum(X*mean.reshape((G,9))[labels], axis=1), 0.0))
+            if robust == 'L1':
+                w = w0/np.maximum(d, 1e-9)
+            else:
+                w = w0*np.where(d <= delta, 1.0, delta/np.maximum(d, 1e-9))
+            new_mean = groupMean(w)
+            change = np.max(abs(new_mean-mean))
+            mean = new_mean
+            if change < tol:
+                break
+    if quaternions:
+        mean = R2q(mean)
+    return mean[0] if groups is None else mean
+
+
+def invTrans(T,out=None):
     """
     invTrans computes the inverse 4-by-4 homogeneous transformation of T,
     whose output is of the form:
         T^-1 = | R^T  -R^T*t |
                |  0      1   |
+    It also inverts N-by-4-by-4 or N-by-3-by-4 arrays of transformations.
     """
-    R = T[0:3,0:3]
-    t = np.vstack(T[0:3,3])
-    return np.vstack((np.hstack(( R.T, np.dot(-R.T,t))), np.array([0,0,0,1])))
+    T = np.asarray(T, dtype=float)
+    Rt = np.swapaxes(T[...,:3,:3], -1, -2)
+    t = -np.matmul(Rt, T[...,:3,3:4])
+    return hmtrans(Rt, t, out, compact=(T.shape[-2]==3))
+
+
+def composeTrans(T1,T2,out=None):
+    """
+    composeTrans computes the product T1*T2 of two homogeneous
+    transformations, or of two N-by-4-by-4 (or N-by-3-by-4) arrays of them.
+    Arrays of length 1 are broadcasted against the other.
+    """
+    T1 = np.asarray(T1, dtype=float)
+    T2 = np.asarray(T2, dtype=float)
+    R1 = T1[...,:3,:3]
+    R = np.matmul(R1, T2[...,:3,:3])
+    t = np.matmul(R1, T2[...,:3,3:4]) + T1[...,:3,3:4]
+    return hmtrans(R, t, out, compact=(T1.shape[-2]==3 and T2.shape[-2]==3))
+
+
+def cumTrans(T):
+    """
+    cumTrans computes the absolute transformations of a chain of N relative
+    transformations (e.g. odometry or a kinematic chain), such that:
+        T_abs[i] = T[0]*T[1]*...*T[i]
+
+    The cumulative product is computed as a parallel prefix scan, doing
+    log2(N) products of whole arrays instead of N single products.
+    """
+    T = np.asarray(T, dtype=float)
+    R = T[...,:3,:3].copy()
+    t = T[...,:3,3:4].copy()
+    N = T.shape[0]
+    step = 1
+    while step < N:
+        Rp = R[:-step]
+        t[step:] = np.matmul(Rp, t[step:]) + t[:-step]
+        R[step:] = np.matmul(Rp, R[step:])
+        step *= 2
+    return hmtrans(R, t, compact=(T.shape[-2]==3))
+
+
+def applyTrans(T,points,pairwise=False):
+    """
+    applyTrans applies homogeneous transformations to 3D points.
+    - By default each transformation of T (4-by-4 or N-by-4-by-4) is applied
+      to all the points (3 or M-by-3), giving an array of shape
+      T.shape[:-2] + points.shape[:-1] + (3,), e.g. N-by-M-by-3.
+    - With pairwise=True the N transformations are applied one to one to the
+      N-by-3 points, giving an N-by-3 array.
+    """
+    T = np.asarray(T, dtype=float)
+    points = np.asarray(points, dtype=float)
+    R = T[...,:3,:3]
+    t = T[...,:3,3]
+    if pairwise:
+        if points.shape[:-1] != T.shape[:-2]:
+            raise ValueError("Pairwise transformation needs one point per transformation")
+        return np.einsum('...ij,...j->...i', R, points) + t
+    # Same points for all transformations
+    P = points.reshape((-1,3))
+    out = np.matmul(P, np.swapaxes(R, -1, -2)) + t[...,None,:]
+    return out.reshape(T.shape[:-2] + points.shape[:-1] + (3,))
 
 
 class Quaternion:
@@ -299,6 +668,219 @@ class Quaternion:
         return [qw, qx, qy, qz]
 
 
+class QuaternionArray:
+    """
+    QuaternionArray holds N Quaternions of the form q = [q_w, q_x, q_y, q_z]
+    in one contiguous N-by-4 array of floats (32 bytes per Quaternion) and
+    operates all of them at once.
+
+    Indexing with slices returns a QuaternionArray viewing the same buffer,
+    so changes on it are seen by the original array.
+
+    See:
+    - https://en.wikipedia.org/wiki/Quaternion
+    - https://de.mathworks.com/help/aeroblks/quaternionmultiplication.html
+    """
+    __slots__ = ('q',)
+
+    def __init__(self, q=None, N=1, copy=False):
+        if q is None:
+            q = np.zeros((N,4))
+            q[:,0] = 1.0
+        q = np.array(q, dtype=float) if copy else np.asarray(q, dtype=float)
+        if q.ndim == 1:
+            q = q.reshape((1,-1))
+        if q.shape[-1] not in (3, 4):
+            raise ValueError("Quaternions need 4 elements (or 3 for pure ones)")
+        if q.shape[-1] == 3:
+            # Pure Quaternions from 3D vectors
+            q = np.hstack((np.zeros((q.shape[0],1)), q))
+        self.q = q
+
+    @classmethod
+    def fromR(cls, R, eta=0.0):
+        """fromR builds the Quaternions of an N-by-3-by-3 array of rotations."""
+        return cls(R2q(R, eta))
+
+    @property
+    def w(self):
+        return self.q[:,0]
+
+    @property
+    def v(self):
+        return self.q[:,1:]
+
+    def __len__(self):
+        return self.q.shape[0]
+
+    def __getitem__(self, key):
+        if isinstance(key, (int, np.integer)):
+            key = slice(key, key+1 if key != -1 else None)
+        return QuaternionArray(self.q[key])
+
+    def __setitem__(self, key, value):
+        if isinstance(value, QuaternionArray):
+            value = value.q
+        self.q[key] = value
+
+    def __repr__(self):
+        return "QuaternionArray(" + repr(self.q) + ")"
+
+    def __add__(self, p):
+        return QuaternionArray(self.q + _asQuaternions(p))
+
+    def __sub__(self, p):
+        return QuaternionArray(self.q - _asQuaternions(p))
+
+    def __mul__(self, p):
+        if np.isscalar(p):
+            return QuaternionArray(self.q * p)
+        return self.prod(p)
+
+    def __neg__(self):
+        return QuaternionArray(-self.q)
+
+    def prod(self, p, out=None):
+        """prod computes the Hamilton product self*p of each pair of
+        Quaternions. Arrays of length 1 are broadcasted against the other.
+        """
+        p = _asQuaternions(p)
+        q = self.q
+        if out is None:
+            out = np.empty(np.broadcast_shapes(q.shape, p.shape))
+        elif isinstance(out, QuaternionArray):
+            out = out.q
+        w1, x1, y1, z1 = q[:,0], q[:,1], q[:,2], q[:,3]
+        w2, x2, y2, z2 = p[:,0], p[:,1], p[:,2], p[:,3]
+        w = w1*w2 - x1*x2 - y1*y2 - z1*z2
+        x = w1*x2 + x1*w2 + y1*z2 - z1*y2
+        y = w1*y2 - x1*z2 + y1*w2 + z1*x2
+        out[:,3] = w1*z2 + x1*y2 - y1*x2 + z1*w2
+        out[:,0], out[:,1], out[:,2] = w, x, y
+        return QuaternionArray(out)
+
+    def dot(self, p):
+        """dot computes the inner product of each pair of Quaternions."""
+        return np.sum(self.q*_asQuaternions(p), axis=1)
+
+    def norm(self):
+        return np.sqrt(np.sum(self.q*self.q, axis=1))
+
+    def conjugate(self):
+        return QuaternionArray(self.q * [1.0, -1.0, -1.0, -1.0])
+
+    def inverse(self):
+        return QuaternionArray(self.q * ([1.0, -1.0, -1.0, -1.0] / np.sum(self.q*self.q, axis=1)[:,None]))
+
+    def normalize(self, inplace=False):
+        """normalize returns the unit Quaternions. With inplace=True the
+        buffer itself is normalized.
+        """
+        norm = self.norm()[:,None]
+        if inplace:
+            self.q /= norm
+            return self
+        return QuaternionArray(self.q / norm)
+
+    def rotate(self, v):
+        """rotate applies the rotations of the unit Quaternions to the
+        N-by-3 array of vectors v (or a single 3-vector to all of them),
+        i.e. q * [0, v] * q^*.
+        """
+        v = np.asarray(v, dtype=float)
+        u = self.q[:,1:]
+        t = 2.0*np.cross(u, v)
+        return v + self.q[:,:1]*t + np.cross(u, t)
+
+    def log(self):
+        """log computes the logarithm of each Quaternion."""
+        n = self.norm()
+        vn = np.sqrt(np.sum(self.q[:,1:]**2, axis=1))
+        theta = np.arctan2(vn, self.q[:,0])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scale = np.where(vn > 0.0, theta/vn, 0.0)
+        out = np.empty_like(self.q)
+        out[:,0] = np.log(n)
+        out[:,1:] = self.q[:,1:]*scale[:,None]
+        return QuaternionArray(out)
+
+    def exp(self):
+        """exp computes the exponential of each Quaternion."""
+        vn = np.sqrt(np.sum(self.q[:,1:]**2, axis=1))
+        ew = np.exp(self.q[:,0])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            scale = np.where(vn > 0.0, np.sin(vn)/vn, 1.0)
+        out = np.empty_like(self.q)
+        out[:,0] = ew*np.cos(vn)
+        out[:,1:] = self.q[:,1:]*(ew*scale)[:,None]
+        return QuaternionArray(out)
+
+    def q2R(self, out=None):
+        """q2R builds the N-by-3-by-3 array of rotation matrices."""
+        return q2R(self.q, out)
+
+
+def _asQuaternions(p):
+    """_asQuaternions returns the N-by-4 array of Quaternions in p."""
+    if isinstance(p, QuaternionArray):
+        return p.q
+    return np.asarray(p, dtype=float).reshape((-1,4))
+
+
+def slerp(t, q, t_new, threshold=0.9995, out=None):
+    """
+    slerp resamples the N-by-4 array of unit Quaternions q, taken at the
+    increasing times t, at the M times t_new. It returns the M-by-4 array of
+    Quaternions interpolated with the Spherical Linear intERPolation between
+    the samples enclosing each new time, taking always the shortest arc.
+
+    When two consecutive Quaternions are nearly parallel (their inner product
+    is above threshold) the normalized linear interpolation is used instead.
+    Times out of the range of t take the first or last Quaternion. Repeated
+    times (zero-length intervals) take the first Quaternion of the interval,
+    and a single sample is returned for all new times.
+
+    See Also
+    --------
+    - https://en.wikipedia.org/wiki/Slerp
+    """
+    t = np.asarray(t, dtype=float)
+    q = np.asarray(q, dtype=float)
+    t_new = np.asarray(t_new, dtype=float)
+    if len(t) == 0:
+        raise ValueError("At least one sample is needed to interpolate")
+    if out is None:
+        out = np.empty((len(t_new), 4))
+    if len(t) == 1:
+        out[:] = q[0]
+        return out
+    # Find the samples enclosing each new time
+    idx = np.clip(np.searchsorted(t, t_new, side='right')-1, 0, len(t)-2)
+    t0 = t[idx]
+    dt = t[idx+1]-t0
+    # Zero-length intervals (repeated times) take their first sample
+    tau = np.clip((t_new-t0)/np.where(dt > 0.0, dt, 1.0), 0.0, 1.0)
+    tau[dt <= 0.0] = 0.0
+    q0 = q[idx]
+    q1 = q[idx+1]
+    # Take the shortest arc
+    d = np.sum(q0*q1, axis=1)
+    sign = np.where(d < 0.0, -1.0, 1.0)
+    d *= sign
+    # Weights of the Spherical (or Linear) interpolation
+    linear = d > threshold
+    theta = np.arccos(np.clip(d, -1.0, 1.0))
+    sin_theta = np.sin(theta)
+    sin_theta[linear] = 1.0
+    w0 = np.where(linear, 1.0-tau, np.sin((1.0-tau)*theta)/sin_theta)
+    w1 = np.where(linear, tau, np.sin(tau*theta)/sin_theta)*sign
+    np.multiply(q0, w0[:,None], out=out)
+    out += q1*w1[:,None]
+    # Normalize (needed by the linear interpolation only)
+    out /= np.sqrt(np.sum(out*out, axis=1))[:,None]
+    return out
+
+
 class Mahony:
     def updateIMU(acc, gyr, q=[1.0,0.0,0.0,0.0], freq=default_freq, Kp=0.1, Ki=0.5):
         """Mahony's AHRS algorithm with an IMU architecture.
@@ -382,7 +964,7 @@ class Mahony:
         q0, q1, q2, q3 = q[0], q[1], q[2], q[3]
         # Use IMU algorithm if magnetometer measurement invalid (avoids NaN in magnetometer normalisation)
         if( (mx==0.0) & (my==0.0) & (mz==0.0) ):
-            Mahony.updateIMU(acc, gyr, q, freq, Kp, Ki)
+            return Mahony.updateIMU(acc, gyr, q, freq, Kp, Ki)
         # Compute feedback only if accelerometer measurement valid (avoids NaN in accelerometer normalisation)
         if( not((ax==0.0) & (ay==0.0) & (az==0.0)) ):
             # Normalise accelerometer measurement
@@ -455,6 +1037,123 @@ class Mahony:
         return q_array
 
 
+class MahonyFilter:
+    """
+    MahonyFilter is a stateful version of Mahony's AHRS algorithm.
+
+    The quaternion and the integral feedback are kept between samples as
+    plain floats in slots, so that step() only updates them and does not
+    build any list or array. run() consumes a stream of samples and yields
+    the orientation after each one of them.
+
+    See: "Nonlinear Complementary Filters on the Special Orthogonal Group"
+         https://hal.archives-ouvertes.fr/hal-00488376/document
+    See: http://www.x-io.co.uk/open-source-imu-and-ahrs-algorithms/
+    """
+    __slots__ = ('qw', 'qx', 'qy', 'qz', 'ix', 'iy', 'iz', 'twoKp', 'twoKi', 'freq')
+
+    def __init__(self, q=(1.0,0.0,0.0,0.0), freq=default_freq, Kp=0.1, Ki=0.5):
+        self.qw, self.qx, self.qy, self.qz = [float(x) for x in q]
+        self.ix, self.iy, self.iz = 0.0, 0.0, 0.0
+        self.twoKp = 2.0*Kp     # 2 * proportional gain
+        self.twoKi = 2.0*Ki     # 2 * integral gain
+        self.freq = freq
+
+    @property
+    def q(self):
+        return self.qw, self.qx, self.qy, self.qz
+
+    def reset(self, q=(1.0,0.0,0.0,0.0)):
+        self.qw, self.qx, self.qy, self.qz = [float(x) for x in q]
+        self.ix, self.iy, self.iz = 0.0, 0.0, 0.0
+
+    def step(self, acc, gyr, mag=None):
+        """step updates the orientation with one sample of accelerometer,
+        gyroscope and (optionally) magnetometer readings.
+        """
+        ax, ay, az = acc[0], acc[1], acc[2]
+        gx, gy, gz = gyr[0], gyr[1], gyr[2]
+        qw, qx, qy, qz = self.qw, self.qx, self.qy, self.qz
+        # Compute feedback only if accelerometer measurement valid
+        if not (ax==0.0 and ay==0.0 and az==0.0):
+            # Normalise accelerometer measurement
+            recipNorm = 1.0/math.sqrt(ax*ax + ay*ay + az*az)
+            ax *= recipNorm
+            ay *= recipNorm
+            az *= recipNorm
+            # Estimated direction of gravity
+            halfvx = qx*qz - qw*qy
+            halfvy = qw*qx + qy*qz
+            halfvz = qw*qw + qz*qz - 0.5
+            # Error is cross product between estimated and measured direction of gravity
+            halfex = ay*halfvz - az*halfvy
+            halfey = az*halfvx - ax*halfvz
+            halfez = ax*halfvy - ay*halfvx
+            # Use magnetometer only if its measurement is valid
+            if mag is not None and not (mag[0]==0.0 and mag[1]==0.0 and mag[2]==0.0):
+                mx, my, mz = mag[0], mag[1], mag[2]
+                recipNorm = 1.0/math.sqrt(mx*mx + my*my + mz*mz)
+                mx *= recipNorm
+                my *= recipNorm
+                mz *= recipNorm
+                # Auxiliary variables to avoid repeated arithmetic
+                q0q0, q0q1, q0q2, q0q3 = qw*qw, qw*qx, qw*qy, qw*qz
+                q1q1, q1q2, q1q3 = qx*qx, qx*qy, qx*qz
+                q2q2, q2q3, q3q3 = qy*qy, qy*qz, qz*qz
+                # Reference direction of Earth's magnetic field
+                hx = 2.0*( mx*(0.5 - q2q2 - q3q3) + my*(q1q2 - q0q3)       + mz*(q1q3 + q0q2) )
+                hy = 2.0*( mx*(q1q2 + q0q3)       + my*(0.5 - q1q1 - q3q3) + mz*(q2q3 - q0q1) )
+                bz = 2.0*( mx*(q1q3 - q0q2)       + my*(q2q3 + q0q1)       + mz*(0.5 - q1q1 - q2q2) )
+                bx = math.sqrt(hx*hx + hy*hy)
+                # Estimated direction of magnetic field
+                halfwx = bx*(0.5 - q2q2 - q3q3) + bz*(q1q3 - q0q2)
+                halfwy = bx*(q1q2 - q0q3)       + bz*(q0q1 + q2q3)
+                halfwz = bx*(q0q2 + q1q3)       + bz*(0.5 - q1q1 - q2q2)
+                halfex += my*halfwz - mz*halfwy
+                halfey += mz*halfwx - mx*halfwz
+                halfez += mx*halfwy - my*halfwx
+            # Compute and apply integral feedback if enabled
+            if self.twoKi > 0.0:
+                twoKiFreq = self.twoKi / self.freq
+                self.ix += halfex * twoKiFreq
+                self.iy += halfey * twoKiFreq
+                self.iz += halfez * twoKiFreq
+                gx += self.ix
+                gy += self.iy
+                gz += self.iz
+            else:
+                self.ix, self.iy, self.iz = 0.0, 0.0, 0.0
+            # Apply proportional feedback
+            gx += self.twoKp*halfex
+            gy += self.twoKp*halfey
+            gz += self.twoKp*halfez
+        # Integrate rate of change of quaternion
+        halfT = 0.5 / self.freq
+        gx *= halfT
+        gy *= halfT
+        gz *= halfT
+        qw, qx, qy, qz = (qw + (-qx*gx - qy*gy - qz*gz),
+                          qx + ( qw*gx + qy*gz - qz*gy),
+                          qy + ( qw*gy - qx*gz + qz*gx),
+                          qz + ( qw*gz + qx*gy - qy*gx))
+        # Normalise quaternion
+        recipNorm = 1.0/math.sqrt(qw*qw + qx*qx + qy*qy + qz*qz)
+        self.qw = qw*recipNorm
+        self.qx = qx*recipNorm
+        self.qy = qy*recipNorm
+        self.qz = qz*recipNorm
+
+    def run(self, samples):
+        """run is a generator that consumes an iterable of samples, each of
+        them of the form (acc, gyr) or (acc, gyr, mag), and yields the
+        updated quaternion (qw, qx, qy, qz) after each one.
+        """
+        step = self.step
+        for sample in samples:
+            step(*sample)
+            yield self.qw, self.qx, self.qy, self.qz
+
+
 class Madgwick:
     def updateIMU(acc, gyr, q=np.array([1.0,0.0,0.0,0.0]), beta=0.01, freq=100.0):
         # Get elements from input
@@ -597,6 +1296,362 @@ class Madgwick:
         # Return Numpy Array of updated Quaternion
         return [qw, qx, qy, qz]
 
+    def batchIMU(acc, gyr, q=np.array([1.0,0.0,0.0,0.0]), beta=0.01, freq=100.0, out=None):
+        """Madgwick's AHRS algorithm with an IMU architecture over a whole log.
+
+        Given N-by-3 arrays of accelerometer and gyroscope samples and an
+        initial quaternion q, it returns the N-by-4 array with the orientation
+        estimated after each sample. The results are equal to calling
+        updateIMU once per sample, but the normalization of the measurements
+        is done beforehand over the whole array and the recursion runs over
+        plain floats, writing into the preallocated array out.
+        """
+        acc = np.asarray(acc, dtype=float)
+        gyr = np.asarray(gyr, dtype=float)
+        N = acc.shape[0]
+        if out is None:
+            out = np.empty((N, 4))
+        # Normalize all valid accelerometer measurements at once
+        valid_acc = np.any(acc!=0.0, axis=1)
+        acn = np.sqrt(np.sum(acc*acc, axis=1))
+        acn[~valid_acc] = 1.0
+        acc = acc / acn[:,None]
+        # Plain Python floats are much cheaper to operate than Numpy scalars
+        A = acc.tolist()
+        G = gyr.tolist()
+        V = valid_acc.tolist()
+        qw, qx, qy, qz = [float(x) for x in q]
+        invFreq = 1.0/freq
+        sqrt = math.sqrt
+        for i in range(N):
+            gx, gy, gz = G[i]
+            # Rate of change of quaternion from gyroscope
+            qDot1 = 0.5 * (-qx*gx - qy*gy - qz*gz)
+            qDot2 = 0.5 * ( qw*gx + qy*gz - qz*gy)
+            qDot3 = 0.5 * ( qw*gy - qx*gz + qz*gx)
+            qDot4 = 0.5 * ( qw*gz + qx*gy - qy*gx)
+            if V[i]:
+                ax, ay, az = A[i]
+                # Auxiliary variables to avoid repeated arithmetic
+                qwqw = qw * qw
+                qxqx = qx * qx
+                qyqy = qy * qy
+                qzqz = qz * qz
+                qx_qy = qxqx + qyqy
+                # Gradient decent algorithm corrective step
+                s0 = 2.0*( qy*ax - qx*ay) + 4.0*qw*qx_qy
+                s1 = 2.0*(-qz*ax - qw*ay) + 4.0*qx*(qwqw + qzqz + az - 1.0) + 8.0*qx*qx_qy
+                s2 = 2.0*( qw*ax - qz*ay) + 4.0*qy*(qwqw + qzqz + az - 1.0) + 8.0*qy*qx_qy
+                s3 = 2.0*(-qx*ax - qy*ay) + 4.0*qz*qx_qy
+                # Apply normalized feedback step
+                # Null gradient (already aligned) needs no correction
+                sNorm = sqrt(s0 * s0 + s1 * s1 + s2 * s2 + s3 * s3)
+                if sNorm > 0.0:
+                    recipNorm = beta / sNorm
+                    qDot1 -= recipNorm * s0
+                    qDot2 -= recipNorm * s1
+                    qDot3 -= recipNorm * s2
+                    qDot4 -= recipNorm * s3
+            # Integrate rate of change of quaternion to yield quaternion
+            qw += qDot1 * invFreq
+            qx += qDot2 * invFreq
+            qy += qDot3 * invFreq
+            qz += qDot4 * invFreq
+            # Normalise quaternion
+            recipNorm = 1.0 / sqrt(qw * qw + qx * qx + qy * qy + qz * qz)
+            qw *= recipNorm
+            qx *= recipNorm
+            qy *= recipNorm
+            qz *= recipNorm
+            out[i] = qw, qx, qy, qz
+        return out
+
+    def batchMARG(acc, gyr, mag, q=np.array([1.0,0.0,0.0,0.0]), beta=0.01, freq=100.0, out=None):
+        """Madgwick's AHRS algorithm with a MARG architecture over a whole log.
+
+        Given N-by-3 arrays of accelerometer, gyroscope and magnetometer
+        samples and an initial quaternion q, it returns the N-by-4 array with
+        the orientation estimated after each sample, as updateMARG would do
+        sample by sample. Samples without a valid magnetometer measurement
+        fall back to the IMU corrective step.
+        """
+        acc = np.asarray(acc, dtype=float)
+        gyr = np.asarray(gyr, dtype=float)
+        mag = np.asarray(mag, dtype=float)
+        N = acc.shape[0]
+        if out is None:
+            out = np.empty((N, 4))
+        # Normalize all valid accelerometer and magnetometer measurements at once
+        valid_acc = np.any(acc!=0.0, axis=1)
+        valid_mag = np.any(mag!=0.0, axis=1)
+        acn = np.sqrt(np.sum(acc*acc, axis=1))
+        acn[~valid_acc] = 1.0
+        mgn = np.sqrt(np.sum(mag*mag, axis=1))
+        mgn[~valid_mag] = 1.0
+        acc = acc / acn[:,None]
+        mag = mag / mgn[:,None]
+        # Plain Python floats are much cheaper to operate than Numpy scalars
+        A = acc.tolist()
+        G = gyr.tolist()
+        M = mag.tolist()
+        VA = valid_acc.tolist()
+        VM = valid_mag.tolist()
+        qw, qx, qy, qz = [float(x) for x in q]
+        invFreq = 1.0/freq
+        sqrt = math.sqrt
+        for i in range(N):
+            gx, gy, gz = G[i]
+            # Rate of change of quaternion from gyroscope
+            qDot1 = 0.5*(-qx*gx - qy*gy - qz*gz)
+            qDot2 = 0.5*( qw*gx + qy*gz - qz*gy)
+            qDot3 = 0.5*( qw*gy - qx*gz + qz*gx)
+            qDot4 = 0.5*( qw*gz + qx*gy - qy*gx)
+            if VA[i] and VM[i]:
+                ax, ay, az = A[i]
+                mx, my, mz = M[i]
+                # Auxiliary variables to avoid repeated arithmetic
+                qwqw = qw*qw
+                qwqx = qw*qx
+                qwqy = qw*qy
+                qwqz = qw*qz
+                qxqx = qx*qx
+                qxqy = qx*qy
+                qxqz = qx*qz
+                qyqy = qy*qy
+                qyqz = qy*qz
+                qzqz = qz*qz
+                _2qwqy = 2.0*qwqy
+                _2qyqz = 2.0*qyqz
+                # Reference direction of Earth's magnetic field
+                hx     =      mx*(qwqw + qxqx - qyqy - qzqz)  - 2.0*my*(qwqz - qxqy)               + 2.0*mz*(qwqy + qxqz)
+                hy     =  2.0*mx*(qwqz + qxqy)                +     my*(qwqw - qxqx + qyqy - qzqz) - 2.0*mz*(qwqx - qyqz)
+                hz     = -2.0*mx*(qwqy - qxqz)                + 2.0*my*(qwqx + qyqz)               +     mz*(qwqw - qxqx - qyqy + qzqz)
+                hxhy   = sqrt(hx*hx + hy*hy)
+                _2hxhy = 2.0*hxhy
+                _2hz   = 2.0*hz
+                _2qax  = 2.0*qxqz - _2qwqy - ax
+                _2qay  = 2.0*qwqx + _2qyqz - ay
+                _4qaz  = 4.0*(1.0 - 2.0*qxqx - 2.0*qyqy - az)
+                sumx = hxhy*(0.5 - qyqy - qzqz)  + hz*(qxqz - qwqy)       - mx
+                sumy = hxhy*(qxqy - qwqz)        + hz*(qwqx + qyqz)       - my
+                sumz = hxhy*(qwqy + qxqz)        + hz*(0.5 - qxqx - qyqy) - mz
+                # Gradient decent algorithm corrective step
+                s0 = 2.0*(-qy*_2qax + qx*_2qay)            - sumx*hz*qy                + sumy*(-hxhy*qz + hz*qx) + sumz*hxhy*qy
+                s1 = 2.0*( qz*_2qax + qw*_2qay) - qx*_4qaz + sumx*hz*qz                + sumy*( hxhy*qy + hz*qw) + sumz*(hxhy*qz - _2hz*qx)
+                s2 = 2.0*(-qw*_2qax + qz*_2qay) - qy*_4qaz - sumx*( _2hxhy*qy + hz*qw) + sumy*( hxhy*qx + hz*qz) + sumz*(hxhy*qw - _2hz*qy)
+                s3 = 2.0*( qx*_2qax + qy*_2qay)            + sumx*(-_2hxhy*qz + hz*qx) + sumy*(-hxhy*qw + hz*qy) + sumz*hxhy*qx
+            elif VA[i]:
+                ax, ay, az = A[i]
+                # IMU corrective step
+                qwqw = qw*qw
+                qxqx = qx*qx
+                qyqy = qy*qy
+                qzqz = qz*qz
+                qx_qy = qxqx + qyqy
+                s0 = 2.0*( qy*ax - qx*ay) + 4.0*qw*qx_qy
+                s1 = 2.0*(-qz*ax - qw*ay) + 4.0*qx*(qwqw + qzqz + az - 1.0) + 8.0*qx*qx_qy
+                s2 = 2.0*( qw*ax - qz*ay) + 4.0*qy*(qwqw + qzqz + az - 1.0) + 8.0*qy*qx_qy
+                s3 = 2.0*(-qx*ax - qy*ay) + 4.0*qz*qx_qy
+            sNorm = sqrt(s0*s0 + s1*s1 + s2*s2 + s3*s3) if VA[i] else 0.0
+            # Apply normalized feedback step (none for a null gradient)
+            if sNorm > 0.0:
+                invsqrt = beta / sNorm
+                qDot1 -= invsqrt*s0
+                qDot2 -= invsqrt*s1
+                qDot3 -= invsqrt*s2
+                qDot4 -= invsqrt*s3
+            # Integrate rate of change of quaternion to yield quaternion
+            qw += qDot1 * invFreq
+            qx += qDot2 * invFreq
+            qy += qDot3 * invFreq
+            qz += qDot4 * invFreq
+            # Normalize quaternion
+            invsqrt = 1.0 / sqrt(qw*qw + qx*qx + qy*qy + qz*qz)
+            qw *= invsqrt
+            qx *= invsqrt
+            qy *= invsqrt
+            qz *= invsqrt
+            out[i] = qw, qx, qy, qz
+        return out
+
+
+def _normalizeRows(V):
+    """_normalizeRows returns the rows of the K-by-3 array V normalized, and
+    a K-vector mask telling which rows are valid (not all zeros). The invalid
+    rows are returned as zeros.
+    """
+    valid = np.any(V!=0.0, axis=1)
+    norm = np.sqrt(np.sum(V*V, axis=1))
+    norm[~valid] = 1.0
+    return V / norm[:,None], valid
+
+
+class AHRSFleet:
+    """
+    AHRSFleet estimates the orientation of K independent devices at once.
+
+    The state is a K-by-4 array of quaternions (one row per device) and each
+    call to updateIMU or updateMARG takes K-by-3 blocks of sensor readings,
+    one row per device. The filters of Mahony or Madgwick are applied to all
+    devices with array operations. Devices with an invalid (all zeros)
+    accelerometer or magnetometer reading are masked out instead of
+    branching, in the same way the single device algorithms skip them.
+
+    Mahony's integral feedback is kept per device in the K-by-3 array eInt.
+    """
+    def __init__(self, K=1, q=None, algorithm='madgwick', beta=0.01, Kp=0.1, Ki=0.5, freq=default_freq):
+        if algorithm not in ['madgwick', 'mahony']:
+            raise ValueError("Unknown algorithm '%s'" % algorithm)
+        if q is None:
+            q = np.tile([1.0, 0.0, 0.0, 0.0], (K,1))
+        self.q = np.array(q, dtype=float).reshape((-1,4))
+        self.K = self.q.shape[0]
+        self.eInt = np.zeros((self.K,3))
+        self.algorithm = algorithm
+        self.beta = beta
+        self.Kp = Kp
+        self.Ki = Ki
+        self.freq = freq
+
+    def updateIMU(self, acc, gyr):
+        """updateIMU advances all devices with K-by-3 arrays of accelerometer
+        and gyroscope readings, and returns the updated K-by-4 quaternions.
+        """
+        acc, valid = _normalizeRows(np.asarray(acc, dtype=float))
+        gyr = np.array(gyr, dtype=float)
+        if self.algorithm == 'mahony':
+            self._mahony(acc, gyr, valid)
+        else:
+            self._madgwickIMU(acc, gyr, valid)
+        return self.q
+
+    def updateMARG(self, acc, gyr, mag):
+        """updateMARG advances all devices with K-by-3 arrays of accelerometer,
+        gyroscope and magnetometer readings, and returns the updated K-by-4
+        quaternions. Devices without a valid magnetometer reading are updated
+        as in updateIMU.
+        """
+        acc, valid = _normalizeRows(np.asarray(acc, dtype=float))
+        mag, valid_mag = _normalizeRows(np.asarray(mag, dtype=float))
+        gyr = np.array(gyr, dtype=float)
+        if self.algorithm == 'mahony':
+            self._mahony(acc, gyr, valid, mag, valid_mag)
+        else:
+            self._madgwickMARG(acc, gyr, valid, mag, valid_mag)
+        return self.q
+
+    def _mahony(self, acc, gyr, valid, mag=None, valid_mag=None):
+        qw, qx, qy, qz = self.q.T
+        ax, ay, az = acc.T
+        # Estimated direction of gravity
+        halfvx = qx*qz - qw*qy
+        halfvy = qw*qx + qy*qz
+        halfvz = qw*qw + qz*qz - 0.5
+        # Error is cross product between estimated and measured direction of gravity
+        halfe = np.column_stack((ay*halfvz - az*halfvy,
+                                 az*halfvx - ax*halfvz,
+                                 ax*halfvy - ay*halfvx))
+        if mag is not None:
+            mx, my, mz = mag.T
+            q0q0, q0q1, q0q2, q0q3 = qw*qw, qw*qx, qw*qy, qw*qz
+            q1q1, q1q2, q1q3 = qx*qx, qx*qy, qx*qz
+            q2q2, q2q3, q3q3 = qy*qy, qy*qz, qz*qz
+            # Reference direction of Earth's magnetic field
+            hx = 2.0*( mx*(0.5 - q2q2 - q3q3) + my*(q1q2 - q0q3)       + mz*(q1q3 + q0q2) )
+            hy = 2.0*( mx*(q1q2 + q0q3)       + my*(0.5 - q1q1 - q3q3) + mz*(q2q3 - q0q1) )
+            bz = 2.0*( mx*(q1q3 - q0q2)       + my*(q2q3 + q0q1)       + mz*(0.5 - q1q1 - q2q2) )
+            bx = np.sqrt(hx*hx + hy*hy)
+            # Estimated direction of magnetic field
+            halfwx = bx*(0.5 - q2q2 - q3q3) + bz*(q1q3 - q0q2)
+            halfwy = bx*(q1q2 - q0q3)       + bz*(q0q1 + q2q3)
+            halfwz = bx*(q0q2 + q1q3)       + bz*(0.5 - q1q1 - q2q2)
+            # Invalid magnetometer readings are zeros and add no error
+            halfe += np.column_stack((my*halfwz - mz*halfwy,
+                                      mz*halfwx - mx*halfwz,
+                                      mx*halfwy - my*halfwx))
+        # Devices with invalid accelerometer readings get no feedback
+        halfe *= valid[:,None]
+        # Integral and proportional feedback
+        if self.Ki > 0.0:
+            self.eInt += halfe*(2.0*self.Ki/self.freq)
+        else:
+            self.eInt[:] = 0.0
+        # Devices with invalid accelerometer readings get no integral term either
+        gyr += self.eInt*valid[:,None] + halfe*(2.0*self.Kp)
+        # Integrate rate of change of quaternion
+        self._integrate(0.5*self._qDot(gyr))
+
+    def _madgwickIMU(self, acc, gyr, valid):
+        qw, qx, qy, qz = self.q.T
+        ax, ay, az = acc.T
+        qwqw = qw*qw
+        qzqz = qz*qz
+        qx_qy = qx*qx + qy*qy
+        # Gradient decent algorithm corrective step
+        s = np.column_stack((2.0*( qy*ax - qx*ay) + 4.0*qw*qx_qy,
+                             2.0*(-qz*ax - qw*ay) + 4.0*qx*(qwqw + qzqz + az - 1.0) + 8.0*qx*qx_qy,
+                             2.0*( qw*ax - qz*ay) + 4.0*qy*(qwqw + qzqz + az - 1.0) + 8.0*qy*qx_qy,
+                             2.0*(-qx*ax - qy*ay) + 4.0*qz*qx_qy))
+        self._madgwickStep(gyr, s, valid)
+
+    def _madgwickMARG(self, acc, gyr, valid, mag, valid_mag):
+        qw, qx, qy, qz = self.q.T
+        ax, ay, az = acc.T
+        mx, my, mz = mag.T
+        qwqw, qwqx, qwqy, qwqz = qw*qw, qw*qx, qw*qy, qw*qz
+        qxqx, qxqy, qxqz = qx*qx, qx*qy, qx*qz
+        qyqy, qyqz, qzqz = qy*qy, qy*qz, qz*qz
+        # Reference direction of Earth's magnetic field
+        hx     =      mx*(qwqw + qxqx - qyqy - qzqz)  - 2.0*my*(qwqz - qxqy)               + 2.0*mz*(qwqy + qxqz)
+        hy     =  2.0*mx*(qwqz + qxqy)                +     my*(qwqw - qxqx + qyqy - qzqz) - 2.0*mz*(qwqx - qyqz)
+        hz     = -2.0*mx*(qwqy - qxqz)                + 2.0*my*(qwqx + qyqz)               +     mz*(qwqw - qxqx - qyqy + qzqz)
+        hxhy   = np.sqrt(hx*hx + hy*hy)
+        _2hxhy = 2.0*hxhy
+        _2hz   = 2.0*hz
+        _2qax  = 2.0*qxqz - 2.0*qwqy - ax
+        _2qay  = 2.0*qwqx + 2.0*qyqz - ay
+        _4qaz  = 4.0*(1.0 - 2.0*qxqx - 2.0*qyqy - az)
+        sumx = hxhy*(0.5 - qyqy - qzqz)  + hz*(qxqz - qwqy)       - mx
+        sumy = hxhy*(qxqy - qwqz)        + hz*(qwqx + qyqz)       - my
+        sumz = hxhy*(qwqy + qxqz)        + hz*(0.5 - qxqx - qyqy) - mz
+        # Gradient decent algorithm corrective step
+        s = np.column_stack((
+            2.0*(-qy*_2qax + qx*_2qay)            - sumx*hz*qy                + sumy*(-hxhy*qz + hz*qx) + sumz*hxhy*qy,
+            2.0*( qz*_2qax + qw*_2qay) - qx*_4qaz + sumx*hz*qz                + sumy*( hxhy*qy + hz*qw) + sumz*(hxhy*qz - _2hz*qx),
+            2.0*(-qw*_2qax + qz*_2qay) - qy*_4qaz - sumx*( _2hxhy*qy + hz*qw) + sumy*( hxhy*qx + hz*qz) + sumz*(hxhy*qw - _2hz*qy),
+            2.0*( qx*_2qax + qy*_2qay)            + sumx*(-_2hxhy*qz + hz*qx) + sumy*(-hxhy*qw + hz*qy) + sumz*hxhy*qx))
+        # Devices without magnetometer use the corrective step of the IMU
+        if not valid_mag.all():
+            qx_qy = qxqx + qyqy
+            s_imu = np.column_stack((2.0*( qy*ax - qx*ay) + 4.0*qw*qx_qy,
+                                     2.0*(-qz*ax - qw*ay) + 4.0*qx*(qwqw + qzqz + az - 1.0) + 8.0*qx*qx_qy,
+                                     2.0*( qw*ax - qz*ay) + 4.0*qy*(qwqw + qzqz + az - 1.0) + 8.0*qy*qx_qy,
+                                     2.0*(-qx*ax - qy*ay) + 4.0*qz*qx_qy))
+            s = np.where(valid_mag[:,None], s, s_imu)
+        self._madgwickStep(gyr, s, valid)
+
+    def _madgwickStep(self, gyr, s, valid):
+        # Normalise step magnitude of valid devices only (a null step stays null)
+        sn = np.sqrt(np.sum(s*s, axis=1))
+        sn[~valid | (sn == 0.0)] = 1.0
+        s *= (self.beta*valid/sn)[:,None]
+        # Apply feedback step and integrate
+        self._integrate(0.5*self._qDot(gyr) - s)
+
+    def _qDot(self, gyr):
+        # Quaternion product q * [0, g] for all devices
+        qw, qx, qy, qz = self.q.T
+        gx, gy, gz = gyr.T
+        return np.column_stack((-qx*gx - qy*gy - qz*gz,
+                                 qw*gx + qy*gz - qz*gy,
+                                 qw*gy - qx*gz + qz*gx,
+                                 qw*gz + qx*gy - qy*gx))
+
+    def _integrate(self, qDot):
+        # Integrate rate of change of quaternion and normalize
+        self.q += qDot/self.freq
+        self.q /= np.sqrt(np.sum(self.q*self.q, axis=1))[:,None]
+
 
 ## TEST FUNCTIONS ##
 
@@ -706,6 +1761,350 @@ def test_Quaternions(debug=False):
     assertTest( all(new_q.q==another_q.q) , "Conversion to and from rotation matrix")
 
 
+def test_Madgwick(debug=False):
+    """
+    Test that the batch versions of Madgwick's algorithm give the same
+    orientations as the sample-by-sample updates.
+    """
+    N = 500
+    acc = np.random.random((N,3))-0.5 + np.array([0.0, 0.0, 9.81])
+    gyr = np.random.random((N,3))-0.5
+    mag = np.random.random((N,3))-0.5 + np.array([0.3, 0.0, -0.4])
+    acc[10] = 0.0                                       # Invalid measurement
+    q_imu = np.zeros((N,4))
+    q_marg = np.zeros((N,4))
+    q1 = q2 = np.array([1.0, 0.0, 0.0, 0.0])
+    for i in range(N):
+        q1 = q_imu[i] = Madgwick.updateIMU(acc[i].copy(), gyr[i], q1)
+        q2 = q_marg[i] = Madgwick.updateMARG(acc[i].copy(), gyr[i], mag[i].copy(), q2)
+    Q_imu = Madgwick.batchIMU(acc, gyr)
+    Q_marg = Madgwick.batchMARG(acc, gyr, mag)
+    if debug:
+        print("----------------------------------------------------------------------")
+        print("Max. difference IMU  =", np.max(abs(Q_imu-q_imu)))
+        print("Max. difference MARG =", np.max(abs(Q_marg-q_marg)))
+    assertTest( np.allclose(Q_imu, q_imu, atol=1e-12) , "Batch IMU equals sample-wise updates")
+    assertTest( np.allclose(Q_marg, q_marg, atol=1e-12) , "Batch MARG equals sample-wise updates")
+    # A level device at rest has a null gradient
+    Q_level = Madgwick.batchIMU([[0.0, 0.0, 9.81]], np.zeros((1,3)))
+    Q_level_marg = Madgwick.batchMARG([[0.0, 0.0, 9.81]], np.zeros((1,3)), [[1.0, 0.0, 0.0]])
+    assertTest( np.allclose(Q_level, [[1.0, 0.0, 0.0, 0.0]]) and np.all(np.isfinite(Q_level_marg)) ,
+                "Batch updates with null gradient")
+
+
+def test_Fleet(debug=False):
+    """
+    Test that AHRSFleet gives the same orientations as the single device
+    algorithms applied to each device separately.
+    """
+    K, N = 8, 50
+    acc = np.random.random((N,K,3))-0.5 + np.array([0.0, 0.0, 9.81])
+    gyr = np.random.random((N,K,3))-0.5
+    mag = np.random.random((N,K,3))-0.5 + np.array([0.3, 0.0, -0.4])
+    acc[5,2] = 0.0                                      # Invalid measurements
+    mag[7,3] = 0.0
+    madgwick = AHRSFleet(K, algorithm='madgwick')
+    mahony = AHRSFleet(K, algorithm='mahony', Ki=0.0)
+    q_madg = np.tile([1.0, 0.0, 0.0, 0.0], (K,1))
+    q_mah = q_madg.copy()
+    for i in range(N):
+        madgwick.updateMARG(acc[i], gyr[i], mag[i])
+        mahony.updateIMU(acc[i], gyr[i])
+        for k in range(K):
+            if all(mag[i,k]==0.0):
+                q_madg[k] = Madgwick.updateIMU(acc[i,k].copy(), gyr[i,k], q_madg[k])
+            else:
+                q_madg[k] = Madgwick.updateMARG(acc[i,k].copy(), gyr[i,k], mag[i,k].copy(), q_madg[k])
+            q_mah[k] = Mahony.updateIMU(acc[i,k].copy(), gyr[i,k].copy(), q_mah[k], Ki=0.0)
+    if debug:
+        print("----------------------------------------------------------------------")
+        print("Max. difference Madgwick =", np.max(abs(madgwick.q-q_madg)))
+        print("Max. difference Mahony   =", np.max(abs(mahony.q-q_mah)))
+    assertTest( np.allclose(madgwick.q, q_madg, atol=1e-12) , "Fleet of Madgwick filters")
+    assertTest( np.allclose(mahony.q, q_mah, atol=1e-12) , "Fleet of Mahony filters")
+    # Integral feedback against stateful filters, with invalid readings
+    imu = AHRSFleet(K, algorithm='mahony', Ki=0.5)
+    marg = AHRSFleet(K, algorithm='mahony', Ki=0.5)
+    f_imu = [MahonyFilter(Ki=0.5) for k in range(K)]
+    f_marg = [MahonyFilter(Ki=0.5) for k in range(K)]
+    for i in range(N):
+        imu.updateIMU(acc[i], gyr[i])
+        marg.updateMARG(acc[i], gyr[i], mag[i])
+        for k in range(K):
+            f_imu[k].step(acc[i,k], gyr[i,k])
+            f_marg[k].step(acc[i,k], gyr[i,k], mag[i,k])
+    q_imu = np.array([f.q for f in f_imu])
+    q_marg = np.array([f.q for f in f_marg])
+    if debug:
+        print("Max. difference Mahony with integral (IMU)  =", np.max(abs(imu.q-q_imu)))
+        print("Max. difference Mahony with integral (MARG) =", np.max(abs(marg.q-q_marg)))
+    assertTest( np.allclose(imu.q, q_imu, atol=1e-12) and np.allclose(marg.q, q_marg, atol=1e-12) ,
+                "Fleet of Mahony filters with integral feedback")
+    level = AHRSFleet(2)
+    level.updateIMU([[0.0, 0.0, 9.81]]*2, np.zeros((2,3)))
+    assertTest( np.allclose(level.q, [[1.0, 0.0, 0.0, 0.0]]*2) , "Fleet with null gradient")
+
+
+def test_MahonyFilter(debug=False):
+    """
+    Test that MahonyFilter without integral feedback follows the stateless
+    Mahony algorithm, and that its integral feedback is kept between samples.
+    """
+    N = 200
+    acc = np.random.random((N,3))-0.5 + np.array([0.0, 0.0, 9.81])
+    gyr = np.random.random((N,3))-0.5
+    mag = np.random.random((N,3))-0.5 + np.array([0.3, 0.0, -0.4])
+    mahony = MahonyFilter(Ki=0.0)
+    q = [1.0, 0.0, 0.0, 0.0]
+    max_diff = 0.0
+    for q_filter, a, g, m in zip(mahony.run(zip(acc, gyr, mag)), acc, gyr, mag):
+        q = Mahony.updateMARG(a.copy(), g.copy(), m.copy(), q, Ki=0.0)
+        max_diff = max(max_diff, np.max(abs(np.array(q_filter)-q)))
+    integral = MahonyFilter(Ki=0.5)
+    for a, g in zip(acc, gyr):
+        integral.step(a, g)
+    if debug:
+        print("----------------------------------------------------------------------")
+        print("Max. difference  =", max_diff)
+        print("Integral error   =", integral.ix, integral.iy, integral.iz)
+    assertTest( max_diff < 1e-12 , "MahonyFilter follows Mahony's algorithm")
+    assertTest( (integral.ix, integral.iy, integral.iz) != (0.0, 0.0, 0.0) , "Integral feedback is kept between samples")
+
+
+def test_Conversions(debug=False):
+    """
+    Test that the conversions over arrays of rotations give the same results
+    as the conversions of single rotations.
+    """
+    N = 100
+    angs = np.random.random((N,3))*360-180
+    q = np.random.random((N,4))-0.5
+    q /= np.sqrt(np.sum(q*q, axis=1))[:,None]
+    q *= np.sign(q[:,:1])                               # Take q_w >= 0
+    R_angs = rotate(angs[:,0], angs[:,1], angs[:,2])
+    R_quat = q2R(q)
+    diff_angs = max([np.max(abs(R_angs[i]-rotate(*angs[i]))) for i in range(N)])
+    diff_quat = max([np.max(abs(R_quat[i]-q2R(q[i]))) for i in range(N)])
+    diff_back = np.max(abs(R2q(R_quat)-q))
+    if debug:
+        print("----------------------------------------------------------------------")
+        print("Max. difference rotate =", diff_angs)
+        print("Max. difference q2R    =", diff_quat)
+        print("Max. difference R2q    =", diff_back)
+    assertTest( diff_angs < 1e-12 , "Rotations from arrays of Euler angles")
+    assertTest( diff_quat < 1e-12 , "Rotations from arrays of Quaternions")
+    assertTest( diff_back < 1e-12 , "Quaternions from arrays of rotations")
+    # Rotations of 180 degrees about oblique axes
+    axes = np.random.random((N,3))-0.5
+    axes /= np.sqrt(np.sum(axes*axes, axis=1))[:,None]
+    K = np.zeros((N,3,3))
+    K[:,0,1], K[:,0,2], K[:,1,2] = -axes[:,2], axes[:,1], -axes[:,0]
+    K -= np.swapaxes(K, 1, 2)
+    R_half = np.eye(3) + 2.0*np.matmul(K, K)          # Rodrigues with theta = pi
+    q90 = np.r_[np.cos(np.pi/4), np.sin(np.pi/4)*np.array([1.0,-1.0,1.0])/np.sqrt(3.0)]
+    R90 = q2R(q90)
+    R_half = np.concatenate((R_half, [np.dot(R90, R90)]))
+    diff_half = np.max(abs(q2R(R2q(R_half))-R_half))
+    if debug:
+        print("Max. difference R2q at 180 degrees =", diff_half)
+    assertTest( diff_half < 1e-12 , "Quaternions from rotations of 180 degrees")
+
+
+def test_QuaternionArray(debug=False):
+    """
+    Test the algebra of QuaternionArray against the rotation matrices.
+    """
+    N = 100
+    p = QuaternionArray(np.random.random((N,4))-0.5).normalize()
+    q = QuaternionArray(np.random.random((N,4))-0.5).normalize()
+    v = np.random.random((N,3))
+    R = np.matmul(p.q2R(), q.q2R())
+    Rv = np.einsum('nij,nj->ni', p.q2R(), v)
+    identity = p * p.inverse()
+    view = p[10:20]
+    view.normalize(inplace=True)
+    if debug:
+        print("----------------------------------------------------------------------")
+        print("Max. difference of product  =", np.max(abs((p*q).q2R()-R)))
+        print("Max. difference of rotation =", np.max(abs(p.rotate(v)-Rv)))
+    assertTest( np.allclose((p*q).q2R(), R) , "Product of Quaternion arrays")
+    assertTest( np.allclose(p.rotate(v), Rv) , "Rotation of vectors with Quaternion arrays")
+    assertTest( np.allclose(identity.q, [1.0, 0.0, 0.0, 0.0]) , "Inverse of Quaternion arrays")
+    assertTest( np.allclose(p.log().exp().q, p.q) , "Logarithm and exponential of Quaternion arrays")
+    assertTest( np.shares_memory(view.q, p.q) , "Slices of Quaternion arrays are views")
+    pure = QuaternionArray([1.0, 2.0, 3.0])
+    assertTest( np.allclose(pure.q, [[0.0, 1.0, 2.0, 3.0]]) and QuaternionArray([1.0, 0.0, 0.0, 0.0]).q.shape == (1,4) ,
+                "Quaternion arrays from single vectors")
+
+
+def test_Slerp(debug=False):
+    """
+    Test that SLERP of rotations about a fixed axis gives the rotations with
+    the linearly interpolated angles.
+    """
+    t = np.sort(np.random.random(50))*10.0
+    t_new = np.linspace(t[0], t[-1], 200)
+    axis = np.random.random(3)
+    axis /= lin.norm(axis)
+    angle = 0.3*t
+    q = np.column_stack((np.cos(angle/2.0), np.outer(np.sin(angle/2.0), axis)))
+    q[::3] *= -1.0                                      # Same rotations on other hemisphere
+    angle_new = 0.3*t_new
+    q_new = np.column_stack((np.cos(angle_new/2.0), np.outer(np.sin(angle_new/2.0), axis)))
+    q_slerp = slerp(t, q, t_new)
+    diff = np.max(abs(abs(np.sum(q_slerp*q_new, axis=1))-1.0))
+    if debug:
+        print("----------------------------------------------------------------------")
+        print("Max. difference SLERP =", diff)
+    assertTest( diff < 1e-9 , "SLERP of Quaternions")
+    # Repeated times and a single sample
+    q_rep = slerp([0.0, 1.0, 1.0, 2.0], q[:4], [0.5, 1.0, 1.5])
+    q_one = slerp([1.0], q[:1], [0.0, 2.0])
+    assertTest( np.all(np.isfinite(q_rep)) and np.allclose(q_one, q[:1]) , "SLERP with repeated times")
+
+
+def test_Transformations(debug=False):
+    """
+    Test that the transformations over arrays give the same results as the
+    single transformations.
+    """
+    N = 100
+    angs = np.random.random((N,3))*360-180
+    T = hmtrans(rotate(angs[:,0], angs[:,1], angs[:,2]), np.random.random((N,3)))
+    T_abs = cumTrans(T)
+    T_ref = [T[0]]
+    for i in range(1,N):
+        T_ref.append(np.dot(T_ref[-1], T[i]))
+    inv_diff = max([np.max(abs(invTrans(T)[i]-np.linalg.inv(T[i]))) for i in range(N)])
+    chain_diff = np.max(abs(T_abs-np.array(T_ref)))
+    p = np.random.random(3)
+    compact = cumTrans(T[:,:3,:])
+    if debug:
+        print("----------------------------------------------------------------------")
+        print("Max. difference of inverse =", inv_diff)
+        print("Max. difference of chain   =", chain_diff)
+    assertTest( inv_diff < 1e-9 , "Inverse of transformations")
+    assertTest( chain_diff < 1e-9 , "Cumulative composition of transformations")
+    assertTest( np.allclose(compact, T_abs[:,:3,:]) , "Composition of compact transformations")
+    assertTest( np.allclose(applyTrans(T_abs, p)[-1], np.dot(T_ref[-1], np.append(p, 1.0))[:3]) , "Transformation of points")
+    # A cloud of as many points as transformations is still shared by all
+    cloud = np.random.random((N,3))
+    shared = applyTrans(T_abs, cloud)
+    paired = applyTrans(T_abs, cloud, pairwise=True)
+    assertTest( shared.shape == (N,N,3) and np.allclose(shared[3,7], np.dot(T_abs[3], np.append(cloud[7], 1.0))[:3])
+                and np.allclose(paired[7], shared[7,7]) , "Shared and pairwise transformation of points")
+
+
+def test_RotationIndex(debug=False):
+    """
+    Test the chordal distance matrix and the queries of RotationIndex against
+    the distances of each pair of rotations.
+    """
+    N = 200
+    q = np.random.random((N,4))-0.5
+    q /= np.sqrt(np.sum(q*q, axis=1))[:,None]
+    R = q2R(q)
+    D = dchordMatrix(R, tile=64)
+    D_ref = np.array([[lin.norm(R[i]-R[j]) for j in range(N)] for i in range(N)])
+    index = RotationIndex(R)
+    d = 1.0
+    within = index.query(R[0], d)
+    dist, idx = index.nearest(R[:5], k=3)
+    if debug:
+        print("----------------------------------------------------------------------")
+        print("Max. difference of distances =", np.max(abs(D-D_ref)))
+        print("Rotations within %1.2f =" % d, within)
+    assertTest( np.allclose(D, D_ref, atol=1e-6) , "Matrix of chordal distances")
+    assertTest( np.array_equal(within, np.flatnonzero(D_ref[0] <= d)) , "Rotations within a chordal distance")
+    assertTest( np.allclose(dist, np.sort(D_ref[:5], axis=1)[:,:3], atol=1e-6) , "Nearest rotations")
+
+
+def test_MeanRotation(debug=False):
+    """
+    Test the chordal mean of noisy rotations around a known one, with and
+    without outliers, and the averaging of several sets at once.
+    """
+    G, N = 5, 100
+    true_angs = np.random.random((G,3))*360-180
+    R_true = rotate(true_angs[:,0], true_angs[:,1], true_angs[:,2])
+    groups = np.repeat(np.arange(G), N)
+    noise = np.random.normal(0.0, 1.0, (G*N,3))
+    R = np.matmul(R_true[groups], rotate(noise[:,0], noise[:,1], noise[:,2]))
+    # Replace some rotations with outliers
+    outliers = np.random.random(G*N) < 0.2
+    angs = np.random.random((np.sum(outliers),3))*360-180
+    R_out = R.copy()
+    R_out[outliers] = rotate(angs[:,0], angs[:,1], angs[:,2])
+    mean = meanRotation(R[groups==0])
+    means = meanRotation(R, groups=groups)
+    robust = meanRotation(R_out, groups=groups, robust='L1')
+    error = np.max(dchordMatrix(means, R_true).diagonal())
+    error_robust = np.max(dchordMatrix(robust, R_true).diagonal())
+    if debug:
+        print("----------------------------------------------------------------------")
+        print("Max. error of mean        =", error)
+        print("Max. error of robust mean =", error_robust)
+    assertTest( np.allclose(mean, means[0]) , "Chordal mean of one set and of many sets")
+    assertTest( error < 0.05 , "Chordal mean of rotations")
+    assertTest( error_robust < 0.05 , "Robust chordal mean of rotations")
+
+
+def test_am2q(debug=False):
+    """
+    Test the initial pose estimation over arrays with the gravity and the
+    magnetic field seen by devices in known poses, and that the stationary
+    windows are detected.
+    """
+    N = 1000
+    angs = np.column_stack((np.random.uniform(-80.0, 80.0, N), np.random.uniform(-80.0, 80.0, N),
+                            np.random.uniform(-170.0, 170.0, N)))
+    R = rotate(angs[:,0], angs[:,1], angs[:,2])
+    # Reference vectors in the global frame, seen from each device
+    acc = np.einsum('nji,j->ni', R, [0.0, 0.0, 9.81])
+    mag = np.einsum('nji,j->ni', R, [0.2, 0.0, -0.4])
+    acc_copy = acc.copy()
+    q = am2q(acc, mag)
+    e = am2q(acc, mag, rtype='e')
+    e_single = am2q(list(acc[0]), list(mag[0]), rtype='e')
+    # Still device with noise, except for a movement in the middle
+    still_acc = np.random.normal(0.0, 0.01, (N,3)) + np.array([1.0, 2.0, 9.5])
+    still_mag = np.random.normal(0.0, 0.01, (N,3)) + np.array([0.3, 0.1, -0.4])
+    still_acc[300:500] += np.random.normal(0.0, 2.0, (200,3))
+    q_win, starts = am2qWindows(still_acc, still_mag, window=100)
+    if debug:
+        print("----------------------------------------------------------------------")
+        print("Max. error of Euler angles =", np.max(abs(e-angs)))
+        print("Stationary windows start at", starts)
+    assertTest( np.allclose(e, angs) and np.allclose(q2R(q), R) and np.allclose(e_single, angs[0]) ,
+                "Initial pose over arrays")
+    assertTest( np.array_equal(acc, acc_copy) , "Initial pose does not modify its inputs")
+    assertTest( np.array_equal(starts, [0, 100, 200, 500, 600, 700, 800, 900]) , "Detection of stationary windows")
+
+
+def bench_Conversions(N=100000):
+    """
+    Compare the time of converting N rotations with the array functions
+    against a loop over the single rotation functions.
+    """
+    angs = np.random.random((N,3))*360-180
+    q = np.random.random((N,4))-0.5
+    q /= np.sqrt(np.sum(q*q, axis=1))[:,None]
+    R = q2R(q)
+    Q = Quaternion()
+    cases = [("rotate", lambda: [rotate(*a) for a in angs], lambda: rotate(angs[:,0], angs[:,1], angs[:,2])),
+             ("q2R",    lambda: [q2R(p) for p in q],        lambda: q2R(q)),
+             ("fromR",  lambda: [Q.fromR(r) for r in R],    lambda: R2q(R))]
+    print("Converting %d rotations:" % N)
+    for name, loop, vectorized in cases:
+        t = time.time()
+        loop()
+        t_loop = time.time()-t
+        t = time.time()
+        vectorized()
+        t_vect = time.time()-t
+        print("  %-8s loop = %8.4f s   array = %8.4f s   speedup = %6.1fx" % (name, t_loop, t_vect, t_loop/t_vect))
+
+
 def assertTest(condition=False, text=""):
     line_length = 54
     if not type(condition) == bool:
@@ -732,6 +2131,9 @@ if __name__ == "__main__":
         if mode == "--debug":
             dmode = True
             print(Texter.ENBL+"Debug mode is ON"+Texter.ENDC)
+        elif mode == "--bench":
+            bench_Conversions()
+            sys.exit()
         else:
             print(Texter.WARN+"Given parameter is not valid.\nProceeding with default values."+Texter.ENDC)
 
@@ -739,4 +2141,14 @@ if __name__ == "__main__":
     print("Running tests... ")
     test_Rotation(space=smode, debug=dmode)
     test_ChordalDist(debug=dmode)
-    test_Quaternions(debug=dmode)
\ No newline at end of file
+    test_Quaternions(debug=dmode)
+    test_Madgwick(debug=dmode)
+    test_Fleet(debug=dmode)
+    test_MahonyFilter(debug=dmode)
+    test_Conversions(debug=dmode)
+    test_QuaternionArray(debug=dmode)
+    test_Slerp(debug=dmode)
+    test_Transformations(debug=dmode)
+    test_RotationIndex(debug=dmode)
+    test_MeanRotation(debug=dmode)
+    test_am2q(debug=dmode)
\ No newline at end of file
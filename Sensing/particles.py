@@ -0,0 +1,267 @@
+"""
+Particle Filter for tracking problems that do not fit the linear Kalman
+Filters of tracking.py (non-Gaussian noise, multimodal beliefs, nonlinear
+measurements).
+
+Dimensions:
+    P is the number of particles.
+    m is the number of elements of each state.
+
+Inputs:
+    X is a P-by-m array with one particle (state) per row.
+
+    logw is an array of length P with the logarithms of the weights of the
+    particles.
+
+    motion is a function motion(X, rng) that returns the P-by-m array of the
+    propagated particles. It must operate on the whole array at once.
+
+    loglik is a function loglik(X, z) returning the array of length P with
+    the log-likelihoods of the measurement z for each particle. To use it in
+    a pool of processes it must be defined at the top level of a module.
+
+For futher reference see:
+    [1] Doucet, A. and Johansen, A. M. A Tutorial on Particle Filtering and
+        Smoothing: Fifteen years later. Handbook of Nonlinear Filtering. 2009.
+
+History:
+    18.10.2026. First version with systematic resampling and likelihoods
+                evaluated in a pool of processes with shared memory.
+
+@author: Mario Garcia
+"""
+
+import time
+import multiprocessing as mp
+from multiprocessing import shared_memory
+import numpy as np
+from scipy.special import logsumexp
+from tracking import bcolors, assertTest
+
+
+def systematicResample(logw, rng=None):
+    """
+    systematicResample returns the indices of the particles drawn with
+    systematic resampling from the log-weights logw. A single random offset
+    is used for P evenly spaced positions, which are located in the
+    cumulative sum of the weights.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    P = len(logw)
+    c = np.cumsum(np.exp(logw - np.max(logw)))
+    positions = (rng.random() + np.arange(P)) * (c[-1]/P)
+    return np.minimum(np.searchsorted(c, positions, side='right'), P-1)
+
+
+def effectiveSize(logw):
+    """
+    effectiveSize returns the effective sample size 1/sum(w^2) of the
+    normalized weights given by logw.
+    """
+    logw = logw - logsumexp(logw)
+    return np.exp(-logsumexp(2.0*logw))
+
+
+# State of the workers of the pool
+_worker = {}
+
+def _attach(x_name, w_name, shape, loglik):
+    """_attach maps the shared particles and log-likelihoods in a worker."""
+    _worker['shm'] = [shared_memory.SharedMemory(name=x_name), shared_memory.SharedMemory(name=w_name)]
+    _worker['X'] = np.ndarray(shape, dtype=float, buffer=_worker['shm'][0].buf)
+    _worker['L'] = np.ndarray(shape[:1], dtype=float, buffer=_worker['shm'][1].buf)
+    _worker['loglik'] = loglik
+
+def _loglikChunk(args):
+    """_loglikChunk evaluates the log-likelihoods of a slice of particles."""
+    start, stop, z = args
+    _worker['L'][start:stop] = _worker['loglik'](_worker['X'][start:stop], z)
+
+
+class ParticleFilter:
+    """
+    ParticleFilter keeps the particles in a single P-by-m array X with their
+    log-weights logw, so the motion model and the likelihoods are evaluated
+    for all particles at once. The particles are resampled (systematically)
+    when the effective sample size drops below threshold*P.
+
+    With workers > 1 the particles live in shared memory and the likelihoods
+    are computed by a pool of processes, each one on a slice of the array, so
+    that the particles are never copied between processes. Call close() (or
+    use it in a with block) to release the pool and the shared memory.
+    """
+    def __init__(self, X, motion, loglik, threshold=0.5, workers=1, seed=None):
+        X = np.asarray(X, dtype=float)
+        self.motion, self.loglik = motion, loglik
+        self.threshold = threshold
+        self.rng = np.random.default_rng(seed)
+        self.pool, self.shm = None, []
+        if workers > 1:
+            self.shm = [shared_memory.SharedMemory(create=True, size=X.nbytes),
+                        shared_memory.SharedMemory(create=True, size=X.shape[0]*8)]
+            self.X = np.ndarray(X.shape, dtype=float, buffer=self.shm[0].buf)
+            self.L = np.ndarray(X.shape[:1], dtype=float, buffer=self.shm[1].buf)
+            self.pool = mp.Pool(workers, initializer=_attach,
+                                initargs=(self.shm[0].name, self.shm[1].name, X.shape, loglik))
+            bounds = np.linspace(0, X.shape[0], 4*workers+1).astype(int)
+            self.chunks = list(zip(bounds[:-1], bounds[1:]))
+        else:
+            self.X = np.empty(X.shape)
+        self.X[:] = X
+        self.logw = np.full(X.shape[0], -np.log(X.shape[0]))
+        self.resampled = 0
+
+    def predict(self):
+        """predict propagates all particles with the motion model."""
+        self.X[:] = self.motion(self.X, self.rng)
+        return self.X
+
+    def likelihood(self, z):
+        """likelihood returns the log-likelihoods of z for all particles."""
+        if self.pool is None:
+            return self.loglik(self.X, z)
+        self.pool.map(_loglikChunk, [(start, stop, z) for start, stop in self.chunks])
+        return self.L
+
+    def update(self, z):
+        """update weights the particles with the measurement z and resamples
+        them if their effective sample size is too small.
+        """
+        self.logw += self.likelihood(z)
+        self.logw -= logsumexp(self.logw)
+        if effectiveSize(self.logw) < self.threshold*len(self.logw):
+            self.X[:] = self.X[systematicResample(self.logw, self.rng)]
+            self.logw[:] = -np.log(len(self.logw))
+            self.resampled += 1
+        return self.estimate()
+
+    def step(self, z):
+        """step predicts and updates the particles with the measurement z."""
+        self.predict()
+        return self.update(z)
+
+    def estimate(self):
+        """estimate returns the weighted mean and covariance of the particles."""
+        w = np.exp(self.logw)
+        mean = np.dot(w, self.X)
+        D = self.X - mean
+        return mean, np.dot(D.T*w, D)
+
+    def close(self):
+        """close terminates the pool and releases the shared memory."""
+        if self.pool is not None:
+            self.pool.close()
+            self.pool.join()
+            self.pool = None
+            self.X = self.X.copy()
+            self.L = None
+            for shm in self.shm:
+                shm.close()
+                shm.unlink()
+            self.shm = []
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _randomWalk(X, rng):
+    """_randomWalk is the motion model of the tests."""
+    return X + rng.normal(0.0, 0.1, X.shape)
+
+def _gaussianLoglik(X, z):
+    """_gaussianLoglik is the measurement model of the tests."""
+    return -0.5*np.sum((X - z)**2, axis=1)/0.25
+
+def _costlyLoglik(X, z):
+    """_costlyLoglik is a slow likelihood for the benchmark."""
+    d = np.sqrt(np.sum((X - z)**2, axis=1))
+    return -0.5*(np.sin(d)**2 + np.log1p(d)**2 + np.tanh(d)**2 + d**2)/0.25
+
+
+def test_Resampling(debug=False):
+    """
+    Test that the systematic resampling draws each particle between floor and
+    ceil of P times its weight.
+    """
+    P = 1000
+    logw = np.log(np.random.dirichlet(np.ones(P)))
+    counts = np.bincount(systematicResample(logw), minlength=P)
+    w = np.exp(logw - logsumexp(logw))
+    if debug:
+        print("----------------------------------------------------------------------")
+        print("Effective sample size =", effectiveSize(logw))
+    assertTest( np.all(counts >= np.floor(P*w)-1e-9) and np.all(counts <= np.ceil(P*w)+1e-9) and counts.sum() == P ,
+                "Systematic resampling")
+    assertTest( np.isclose(effectiveSize(np.zeros(P)), P) , "Effective sample size")
+
+
+def test_ParticleFilter(debug=False):
+    """
+    Test the Particle Filter with a 2D random walk measured with Gaussian
+    noise, whose optimal estimate is given by the Kalman Filter.
+    """
+    N, P = 50, 20000
+    x = np.cumsum(np.random.normal(0.0, 0.1, (N,2)), axis=0)
+    Z = x + np.random.normal(0.0, 0.5, (N,2))
+    X0 = np.random.normal(0.0, 1.0, (P,2))
+    pf = ParticleFilter(X0, _randomWalk, _gaussianLoglik)
+    xhat, Pk = np.zeros(2), np.eye(2)
+    max_err = 0.0
+    for i in range(N):
+        mean, cov = pf.step(Z[i])
+        Pk = Pk + 0.01*np.eye(2)
+        K = np.dot(Pk, np.linalg.inv(Pk + 0.25*np.eye(2)))
+        xhat = xhat + np.dot(K, Z[i]-xhat)
+        Pk = Pk - np.dot(K, Pk)
+        max_err = max(max_err, np.max(abs(mean-xhat)))
+    if debug:
+        print("----------------------------------------------------------------------")
+        print("Max. difference to the KF =", max_err, ", resampled", pf.resampled, "times")
+    assertTest( max_err < 0.05 and np.allclose(cov, Pk, atol=0.01) , "Particle Filter against Kalman Filter")
+    # The pool of processes gives the same likelihoods
+    with ParticleFilter(X0, _randomWalk, _gaussianLoglik, workers=2) as pool_pf:
+        assertTest( np.allclose(pool_pf.likelihood(Z[0]), _gaussianLoglik(X0, Z[0])) ,
+                    "Likelihoods in a pool of processes")
+
+
+def bench_Likelihood(P=10**6, workers=4):
+    """
+    Compare the time per step of the Particle Filter with a costly likelihood
+    evaluated in a single process and in a pool of processes.
+    """
+    X0 = np.random.normal(0.0, 1.0, (P,2))
+    z = np.zeros(2)
+    print("Running steps of a Particle Filter with %d particles:" % P)
+    for n in [1, workers]:
+        with ParticleFilter(X0, _randomWalk, _costlyLoglik, workers=n) as pf:
+            t = time.time()
+            for i in range(5):
+                pf.step(z)
+            print("  %d worker(s) %8.2f ms/step" % (n, (time.time()-t)/5*1e3))
+
+
+## MAIN EXECUTION as a script ##
+if __name__ == "__main__":
+    import sys
+
+    # Default values
+    dmode = False       # Debug mode is OFF
+
+    # Read extra parameters (if given)
+    if len(sys.argv) == 2:
+        if sys.argv[1] == "--debug":
+            dmode = True
+            print(bcolors.ENBL+"Debug mode is ON"+bcolors.ENDC)
+        elif sys.argv[1] == "--bench":
+            bench_Likelihood()
+            sys.exit()
+        else:
+            print("This script is not yet fully customizable")
+
+    # Start Running Tests in given mode
+    print("Running tests... ")
+    test_Resampling(debug=dmode)
+    test_ParticleFilter(debug=dmode)
@@ -46,60 +46,1037 @@ History:
                 Function q2coord added.
     21.11.2014. Changed limit of chordal distance in test function.
     24.11.2014. Added test of Quaternions for a valid rotation R.
+    18.10.2026. Added KalmanBank to run many filters at once.
+                Added steady-state Kalman Filter for whole arrays.
+                Update of the KF with Cholesky solves and Joseph form.
+                Added Square-Root Kalman Filter.
+                Added Rauch-Tung-Striebel smoother.
+                Added cache of discretized models per sample rate.
+                EKF with user models and finite-difference Jacobians.
+                Added Unscented Kalman Filter and bank of them.
+                Added per-axis Kalman Filter for decoupled models.
+                Added multi-target tracker with gating and assignment.
+                Added Kalman Filter object operating in place.
+                Added parallel sweep of the noise parameters of the KF.
+                Added event-driven fusion of sensors at different rates.
+                Added Information Filter and its extended version.
 
 @author: Mario Garcia
 """
 
+import time
+import heapq
+import tracemalloc
+import multiprocessing as mp
+from multiprocessing import shared_memory
+from collections import OrderedDict
 import numpy as np
 import scipy.linalg as lin
+from scipy.optimize import linear_sum_assignment
+from scipy.sparse import coo_matrix
+from scipy.sparse.csgraph import connected_components
+from scipy.spatial import cKDTree
+from scipy.stats import chi2
 
 
-def kf(xhat, z, A, P, Q, R, H):
+def kf(xhat, z, A, P, Q, R, H, method='inv'):
     """
     The linear Kalman Filter computes the current state m-by-1 vector
     xhat and its m-by-m Covariance matrix P, given the parameters of the
     previous state.
         m is the number of elements in array xhat.
         n is the length of array z (number of sensor signals to compare).
+    The method used for the update is described in kfUpdate.
     """
-    m = len(xhat)
     n = len(z)
-    I = np.eye(m)
     # KF - Prediction
     xhat = np.dot(A, xhat)
     P    = np.dot(A, np.dot(P, A.T)) + Q
     # KF - Update
-    S    = np.dot(H, np.dot(P, H.T)) + R
-    K    = np.dot(P, np.dot(H.T, lin.inv(S)))
     v    = z.reshape((n,1)) - np.dot(H, xhat)
+    return kfUpdate(xhat, v, P, R, H, method)
+
+
+def kfUpdate(xhat, v, P, R, H, method='inv'):
+    """
+    kfUpdate corrects the predicted state xhat and covariance P with the
+    n-by-1 innovation v = z - H*xhat. Three methods are available:
+    - 'inv': explicit inversion of S and short form of the covariance:
+        K = P*H'*S^-1,   P = (I - K*H)*P
+    - 'cholesky': the gain is solved with the Cholesky factor of S and the
+      covariance is updated with the Joseph form, which keeps P symmetric
+      and positive definite:
+        P = (I - K*H)*P*(I - K*H)' + K*R*K'
+    - 'sequential': for a diagonal R (as built by buildR) each measurement
+      is processed as a scalar update, so no matrix inversion is needed.
+    'inv' is the default, as in previous versions. For small models the
+    other methods are slower in Python (see bench_Update), but they keep P
+    valid over long runs and in single precision.
+    """
+    v = np.asarray(v, dtype=float).reshape((-1,1))
+    if method == 'sequential':
+        r = np.diag(R)
+        if np.any(R != np.diag(r)):
+            raise ValueError("Sequential updates need a diagonal R")
+        xhat = np.array(xhat, dtype=float)
+        P = np.array(P, dtype=float)
+        dx = 0.0
+        for i in range(len(r)):
+            h  = H[i]
+            Ph = np.dot(P, h)
+            s  = np.dot(h, Ph) + r[i]
+            # Innovation corrected with the previous scalar updates
+            k  = Ph * ((v[i,0] - np.dot(h, dx)) / s)
+            dx = dx + k
+            # Scalar update of P, symmetric by construction
+            P -= np.outer(Ph, Ph) / s
+        return xhat + dx.reshape(xhat.shape), P
+    PHt = np.dot(P, H.T)
+    S   = np.dot(H, PHt) + R
+    if method == 'inv':
+        K = np.dot(PHt, lin.inv(S))
+        P = np.dot((np.eye(len(P)) - np.dot(K, H)), P)
+    elif method == 'cholesky':
+        K = lin.cho_solve(lin.cho_factor(S, check_finite=False), PHt.T, check_finite=False).T
+        IKH = np.eye(len(P)) - np.dot(K, H)
+        P = np.dot(IKH, np.dot(P, IKH.T)) + np.dot(K, np.dot(R, K.T))
+    else:
+        raise ValueError("Unknown update method '%s'" % method)
     xhat = xhat + np.dot(K, v)
-    P    = np.dot((I - np.dot(K, H)), P)
     return xhat, P
-    
-    
-def ekf(xhat, z, A, P, Q, R, H):
+
+
+class KalmanFilter:
     """
-    The Extended Kalman Filtering needs the specification of an f-function
-    and an h-function to linearize them. Further development to automate them
-    should be pursued.
-    TODO:
-    - Automated specification of f- and h-function.
+    KalmanFilter is the linear Kalman Filter of kf with all its arrays
+    allocated once. predict() and update(z) write into the state, the
+    covariance and scratch buffers with the out= arguments of numpy, and the
+    gain is solved in place with the Cholesky factor of S (LAPACK potrf and
+    potrs), so no array is allocated per step.
+
+    xhat and P are updated in place; copy them to keep previous values.
+    """
+    __slots__ = ('xhat', 'P', 'A', 'Q', 'R', 'H', '_At', '_Ht', '_x', '_Hx', '_v',
+                 '_mm', '_PHt', '_PHtT', '_K', '_KtT', '_S', '_StT')
+
+    def __init__(self, xhat, P, A, Q, R, H):
+        self.A = np.array(A, dtype=float)
+        self.Q = np.array(Q, dtype=float)
+        self.R = np.array(R, dtype=float)
+        self.H = np.array(H, dtype=float)
+        m, n = self.A.shape[0], self.H.shape[0]
+        self.xhat = np.array(xhat, dtype=float).reshape((m,1))
+        self.P = np.array(P, dtype=float)
+        self._At, self._Ht = self.A.T, self.H.T
+        # Scratch buffers
+        self._x   = np.empty((m,1))
+        self._Hx  = np.empty((n,1))
+        self._v   = np.empty((n,1))
+        self._mm  = np.empty((m,m))
+        self._PHt = np.empty((m,n))
+        self._K   = np.empty((m,n))
+        self._S   = np.empty((n,n))
+        # Transposed views (Fortran ordered) used by LAPACK in place
+        self._PHtT, self._KtT, self._StT = self._PHt.T, self._K.T, self._S.T
+
+    def predict(self):
+        """predict propagates xhat and P in place."""
+        np.matmul(self.A, self.xhat, out=self._x)
+        np.copyto(self.xhat, self._x)
+        np.matmul(self.A, self.P, out=self._mm)
+        np.matmul(self._mm, self._At, out=self.P)
+        np.add(self.P, self.Q, out=self.P)
+        return self.xhat, self.P
+
+    def update(self, z):
+        """update corrects xhat and P in place with the array of n
+        measurements z.
+        """
+        np.matmul(self.H, self.xhat, out=self._Hx)
+        np.subtract(z.reshape(self._v.shape), self._Hx, out=self._v)
+        np.matmul(self.P, self._Ht, out=self._PHt)
+        np.matmul(self.H, self._PHt, out=self._S)
+        np.add(self._S, self.R, out=self._S)
+        # K^T = S^-1 * (P*H^T)^T solved over the buffer of K
+        np.copyto(self._K, self._PHt)
+        _, info = lin.lapack.dpotrf(self._StT, overwrite_a=1)
+        if info != 0:
+            raise np.linalg.LinAlgError("Innovation covariance is not positive definite")
+        lin.lapack.dpotrs(self._StT, self._KtT, overwrite_b=1)
+        # xhat = xhat + K*v,  P = P - K*(P*H^T)^T
+        np.matmul(self._K, self._v, out=self._x)
+        np.add(self.xhat, self._x, out=self.xhat)
+        np.matmul(self._K, self._PHtT, out=self._mm)
+        np.subtract(self.P, self._mm, out=self.P)
+        return self.xhat, self.P
+
+    def step(self, z):
+        """step predicts and updates the filter with the measurements z."""
+        self.predict()
+        return self.update(z)
+
+
+def ekf(xhat, z, f, P, Q, R, h, method='inv', eps=1e-6):
+    """
+    The Extended Kalman Filter computes the current state m-by-1 vector xhat
+    and its m-by-m Covariance matrix P with the nonlinear process model f
+    and measurement model h.
+
+    f and h are functions taking an m-by-K array of states (one per column)
+    and returning the K propagated states or predicted measurements as
+    columns. Their Jacobians are computed by finite differences (see
+    jacobian) with one call of each function per step.
     """
-    m = len(xhat)
     n = len(z)
-    I = np.eye(m)
-    W = np.eye(np.shape(Q)[0])
-    V = np.eye(np.shape(R)[0])
+    xhat = np.asarray(xhat, dtype=float).reshape((-1,1))
     # KF - Prediction
-    xhat = ffunc(A, xhat)
-    P    = np.dot(A, np.dot(P, A.T)) + np.dot(W, np.dot(Q, W.T))
+    xhat, F = jacobian(f, xhat, eps)
+    P    = np.dot(F, np.dot(P, F.T)) + Q
     # KF - Update
-    S    = np.dot(H, np.dot(P, H.T)) + np.dot(V, np.dot(R, V.T))
-    K    = np.dot(P, np.dot(H.T, lin.inv(S)))
-    v    = z.reshape((n,1)) - hfunc(xhat)
-    xhat = xhat + np.dot(K, v)
-    P    = np.dot((I - np.dot(K, H)), P)
-    return xhat, P
+    hx, H = jacobian(h, xhat, eps)
+    v    = z.reshape((n,1)) - hx
+    return kfUpdate(xhat, v, P, R, H, method)
+
+
+def jacobian(func, x, eps=1e-6):
+    """
+    jacobian evaluates the function func at the m-by-1 state x and computes
+    its Jacobian by forward finite differences. The state and its m
+    perturbations are stacked as the columns of an m-by-(m+1) array, so that
+    func is called only once:
+        [y, Y] = func([x, x + eps*I])
+        J = (Y - y) / eps
+    It returns the value func(x) and the Jacobian J.
+    """
+    x = np.asarray(x, dtype=float).reshape((-1,1))
+    m = x.shape[0]
+    X = np.repeat(x, m+1, axis=1)
+    X[:,1:] += eps*np.eye(m)
+    Y = np.asarray(func(X), dtype=float).reshape((-1,m+1))
+    return Y[:,:1], (Y[:,1:]-Y[:,:1])/eps
+
+
+class EKF:
+    """
+    EKF is an Extended Kalman Filter with the vectorized models f and h as
+    described in ekf. Their Jacobians can also be given as functions F and
+    H of the state; otherwise they are computed by finite differences.
+
+    With reuse > 0 the Jacobians are cached and reused while the state moves
+    less than reuse (in euclidean norm) from the state at which they were
+    computed. Then the models are evaluated at the state only.
+    """
+    def __init__(self, xhat, P, f, h, Q, R, F=None, H=None, eps=1e-6, reuse=0.0, method='inv'):
+        self.xhat = np.asarray(xhat, dtype=float).reshape((-1,1))
+        self.P = np.asarray(P, dtype=float)
+        self.f, self.h = f, h
+        self.F, self.H = F, H
+        self.Q, self.R = Q, R
+        self.eps = eps
+        self.reuse = reuse
+        self.method = method
+        self.cache = {}
+
+    def _linearize(self, name, func, jac):
+        # Value of the model and its Jacobian at the current state
+        x = self.xhat
+        if jac is not None:
+            return np.asarray(func(x), dtype=float).reshape((-1,1)), jac(x)
+        if name in self.cache:
+            x0, J = self.cache[name]
+            if lin.norm(x-x0) < self.reuse:
+                return np.asarray(func(x), dtype=float).reshape((-1,1)), J
+        y, J = jacobian(func, x, self.eps)
+        if self.reuse > 0.0:
+            self.cache[name] = (x.copy(), J)
+        return y, J
+
+    def predict(self):
+        self.xhat, F = self._linearize('f', self.f, self.F)
+        self.P = np.dot(F, np.dot(self.P, F.T)) + self.Q
+        return self.xhat, self.P
+
+    def update(self, z):
+        hx, H = self._linearize('h', self.h, self.H)
+        v = np.asarray(z, dtype=float).reshape((-1,1)) - hx
+        self.xhat, self.P = kfUpdate(self.xhat, v, self.P, self.R, H, self.method)
+        return self.xhat, self.P
+
+    def step(self, z):
+        self.predict()
+        return self.update(z)
+
+
+class UKFBank:
+    """
+    UKFBank runs B Unscented Kalman Filters at once, with states as a B-by-m
+    array xhat and covariances as a B-by-m-by-m array P.
+
+    The models f and h are vectorized as in ekf: they take an m-by-K array of
+    states (one per column) and return K columns. The 2m+1 sigma points of
+    all filters are passed through each model in a single call.
+
+    The prediction draws the sigma points of the update from the predicted
+    covariance (which includes Q) with a single Cholesky factor, and update
+    reuses them. With redraw=True they are drawn when update runs instead,
+    e.g. if xhat or P are changed by hand between both steps.
+
+    See:
+    - Wan, E. and van der Merwe, R. The Unscented Kalman Filter for
+      Nonlinear Estimation. IEEE AS-SPCC. 2000.
+    """
+    def __init__(self, xhat, P, f, h, Q, R, alpha=1e-3, beta=2.0, kappa=0.0, redraw=False):
+        self.xhat = np.array(xhat, dtype=float)
+        self.B, self.m = self.xhat.shape
+        self.P = np.array(np.broadcast_to(P, (self.B, self.m, self.m)), dtype=float)
+        self.f, self.h = f, h
+        self.Q = np.asarray(Q, dtype=float)
+        self.R = np.asarray(R, dtype=float)
+        self.redraw = redraw
+        # Weights of the scaled unscented transform
+        m = self.m
+        lamb = alpha**2*(m+kappa) - m
+        self.c = np.sqrt(m+lamb)
+        self.Wm = np.full(2*m+1, 0.5/(m+lamb))
+        self.Wm[0] = lamb/(m+lamb)
+        self.Wc = self.Wm.copy()
+        self.Wc[0] += 1.0 - alpha**2 + beta
+        self.sigmas = None
+
+    def _sigmaPoints(self, x, P):
+        # B-by-(2m+1)-by-m array of sigma points
+        L = np.linalg.cholesky(0.5*(P+np.swapaxes(P, -1, -2)))
+        D = self.c*np.swapaxes(L, -1, -2)
+        return np.concatenate((x[:,None,:], x[:,None,:]+D, x[:,None,:]-D), axis=1)
+
+    def _transform(self, func, X):
+        # Pass all sigma points of all filters through func at once
+        B, S, m = X.shape
+        Y = np.asarray(func(X.reshape((B*S, m)).T), dtype=float)
+        return Y.T.reshape((B, S, -1))
+
+    def _moments(self, Y):
+        mean = np.einsum('s,bsp->bp', self.Wm, Y)
+        dev = Y - mean[:,None,:]
+        return mean, dev, np.einsum('s,bsp,bsq->bpq', self.Wc, dev, dev)
+
+    def predict(self):
+        X = self._sigmaPoints(self.xhat, self.P)
+        Y = self._transform(self.f, X)
+        self.xhat, _, P = self._moments(Y)
+        self.P = P + self.Q
+        self.sigmas = None if self.redraw else self._sigmaPoints(self.xhat, self.P)
+        return self.xhat, self.P
+
+    def update(self, z):
+        """update corrects all filters with the B-by-n array of measurements."""
+        X = self.sigmas
+        if X is None:
+            X = self._sigmaPoints(self.xhat, self.P)
+        Z = self._transform(self.h, X)
+        zm, dz, Pzz = self._moments(Z)
+        Pzz += self.R
+        dx = X - np.einsum('s,bsp->bp', self.Wm, X)[:,None,:]
+        Pxz = np.einsum('s,bsp,bsq->bpq', self.Wc, dx, dz)
+        # K = Pxz * Pzz^-1, solved as K' = Pzz^-1 * Pxz'
+        K = np.swapaxes(np.linalg.solve(Pzz, np.swapaxes(Pxz, -1, -2)), -1, -2)
+        v = np.asarray(z, dtype=float).reshape((self.B, -1)) - zm
+        self.xhat = self.xhat + np.einsum('bpq,bq->bp', K, v)
+        self.P = self.P - np.matmul(K, np.matmul(Pzz, np.swapaxes(K, -1, -2)))
+        self.sigmas = None
+        return self.xhat, self.P
+
+    def step(self, z):
+        self.predict()
+        return self.update(z)
+
+
+class UKF(UKFBank):
+    """
+    UKF is a single Unscented Kalman Filter (see UKFBank) with the m-by-1
+    state xhat and m-by-m covariance P used by kf.
+    """
+    def __init__(self, xhat, P, f, h, Q, R, alpha=1e-3, beta=2.0, kappa=0.0, redraw=False):
+        UKFBank.__init__(self, np.reshape(xhat, (1,-1)), P, f, h, Q, R, alpha, beta, kappa, redraw)
+
+    def predict(self):
+        x, P = UKFBank.predict(self)
+        return x.T, P[0]
+
+    def update(self, z):
+        x, P = UKFBank.update(self, np.reshape(z, (1,-1)))
+        return x.T, P[0]
+
+    def step(self, z):
+        self.predict()
+        return self.update(z)
+
+
+_steady_cache = {}
+
+def steadyGain(A, Q, R, H):
+    """
+    steadyGain computes the m-by-n gain K and the m-by-m a priori covariance
+    P to which a time-invariant Kalman Filter converges, by solving the
+    Discrete Algebraic Riccati Equation:
+        P = A*P*A' - A*P*H'*(H*P*H' + R)^-1*H*P*A' + Q
+    The solutions are cached for the given matrices, so that the DARE is
+    solved only once per model.
+    """
+    A, Q, R, H = [np.asarray(M, dtype=float) for M in (A, Q, R, H)]
+    key = tuple((M.shape, M.tobytes()) for M in (A, Q, R, H))
+    if key not in _steady_cache:
+        if len(_steady_cache) > 32:
+            _steady_cache.clear()
+        P = lin.solve_discrete_are(A.T, H.T, 0.5*(Q+Q.T), R)
+        S = np.dot(H, np.dot(P, H.T)) + R
+        K = lin.solve(S.T, np.dot(P, H.T).T).T
+        _steady_cache[key] = (K, P)
+    return _steady_cache[key]
+
+
+def kfRun(xhat, Z, A, P, Q, R, H, steady=None, tol=1e-12):
+    """
+    kfRun filters a whole N-by-n array of measurements Z with a linear
+    Kalman Filter starting at the state xhat with covariance P. It returns
+    the N-by-m array of estimated states and the last covariance matrix.
+
+    For time-invariant models the covariance converges and the gain becomes
+    constant. Then the filter is a fixed-gain recursion:
+        xhat = (I - K*H)*A*xhat + K*z
+    that needs no matrix inversion. The option steady can be:
+    - None: the complete filter is computed at every sample (as in kf).
+    - 'dare': the steady gain of the DARE is used from the first sample.
+    - 'auto': the complete filter runs until P changes less than tol, and
+      then continues with the last gain.
+    """
+    if steady not in (None, 'dare', 'auto'):
+        raise ValueError("Unknown steady-state option '%s'" % steady)
+    Z = np.asarray(Z, dtype=float)
+    Z = Z.reshape((Z.shape[0], -1))
+    N = Z.shape[0]
+    m = len(xhat)
+    xhat = np.asarray(xhat, dtype=float).reshape((m,1))
+    X = np.empty((N, m))
+    i = 0
+    if steady == 'dare':
+        K, P_prior = steadyGain(A, Q, R, H)
+        P = P_prior - np.dot(K, np.dot(H, P_prior))
+    else:
+        while i < N:
+            xhat, P_new = kf(xhat, Z[i], A, P, Q, R, H)
+            X[i] = xhat[:,0]
+            i += 1
+            converged = np.max(abs(P_new-P)) < tol
+            P = P_new
+            if steady == 'auto' and converged:
+                # Gain of the last (converged) step
+                P_prior = np.dot(A, np.dot(P, A.T)) + Q
+                S = np.dot(H, np.dot(P_prior, H.T)) + R
+                K = lin.solve(S.T, np.dot(P_prior, H.T).T).T
+                break
+    if i < N:
+        # Fixed-gain recursion over the remaining measurements
+        F  = np.dot(np.eye(m) - np.dot(K, H), A)
+        KZ = np.dot(Z[i:], K.T)
+        x  = xhat[:,0]
+        for j in range(N-i):
+            x = np.dot(F, x) + KZ[j]
+            X[i+j] = x
+    return X, P
+
+
+# State of the workers of kfSweep
+_sweep = {}
+
+def _sweepAttach(shared, model):
+    """_sweepAttach maps the shared measurements (and truth) in a worker of
+    kfSweep. shared is a list of (key, name, shape) of the shared arrays.
+    """
+    _sweep['shm'] = []
+    _sweep['truth'] = None
+    for key, name, shape in shared:
+        shm = shared_memory.SharedMemory(name=name)
+        _sweep['shm'].append(shm)
+        _sweep[key] = np.ndarray(shape, dtype=float, buffer=shm.buf)
+    _sweep['model'] = model
+
+def _sweepBlock(cells):
+    """_sweepBlock evaluates a block of cells in a worker of kfSweep."""
+    return _sweepRun(_sweep['Z'], _sweep['truth'], cells, *_sweep['model'])
+
+def _sweepRun(Z, truth, cells, A, H, Qs, Rs, xhat, P, check, stop):
+    """
+    _sweepRun filters the measurements Z with all the cells (pairs of indices
+    of Qs and Rs) at once, as a bank of filters, and returns their scores as
+    rows [rmse, nis, nees, steps]. Every check steps the cells whose average
+    NIS is above stop or below 1/stop are dropped.
+    """
+    B = len(cells)
+    m, n = A.shape[0], H.shape[0]
+    Q, R = Qs[cells[:,0]], Rs[cells[:,1]]
+    # Each cell starts from the same initial state and covariance
+    x = np.tile(np.reshape(xhat, (1,m,1)), (B,1,1))
+    Pk = np.tile(P, (B,1,1))
+    err, nis, nees = np.zeros(B), np.zeros(B), np.zeros(B)
+    scores = np.zeros((B,4))
+    active = np.arange(B)
+    for k in range(len(Z)):
+        # Prediction
+        x = np.matmul(A, x)
+        Pk = np.matmul(np.matmul(A, Pk), A.T) + Q
+        # Update
+        PHt = np.matmul(Pk, H.T)
+        S = np.matmul(H, PHt) + R
+        v = Z[k].reshape((n,1)) - np.matmul(H, x)
+        Sinv_v = np.linalg.solve(S, v)
+        nis += np.sum(v*Sinv_v, axis=(1,2))
+        Kt = np.linalg.solve(np.swapaxes(S, -1, -2), np.swapaxes(PHt, -1, -2))
+        x = x + np.matmul(np.swapaxes(Kt, -1, -2), v)
+        Pk = Pk - np.matmul(np.swapaxes(Kt, -1, -2), np.swapaxes(PHt, -1, -2))
+        if truth is None:
+            err += np.sum(v**2, axis=(1,2))/n
+        else:
+            e = truth[k].reshape((m,1)) - x
+            err += np.sum(e**2, axis=(1,2))/m
+            nees += np.sum(e*np.linalg.solve(Pk, e), axis=(1,2))/m
+        # Early stop of the cells with inconsistent innovations
+        if stop is not None and (k+1) % check == 0 and k+1 < len(Z):
+            mean_nis = nis/(n*(k+1))
+            bad = (mean_nis > stop) | (mean_nis < 1.0/stop)
+            if np.any(bad):
+                scores[active[bad]] = np.c_[np.sqrt(err[bad]/(k+1)), mean_nis[bad], nees[bad]/(k+1), np.full(np.count_nonzero(bad), k+1)]
+                keep = ~bad
+                active, x, Pk, Q, R = active[keep], x[keep], Pk[keep], Q[keep], R[keep]
+                err, nis, nees = err[keep], nis[keep], nees[keep]
+                if len(active) == 0:
+                    return scores
+    N = len(Z)
+    scores[active] = np.c_[np.sqrt(err/N), nis/(n*N), nees/N, np.full(len(active), N)]
+    return scores
+
+
+def kfSweep(Z, A, H, Qs, Rs, xhat, P, truth=None, workers=1, block=256, check=50, stop=None):
+    """
+    kfSweep evaluates the linear Kalman Filter over the N-by-n measurements
+    Z for every combination of the process noises Qs (a list of m-by-m
+    matrices) and the measurement noises Rs (a list of n-by-n matrices).
+    Every combination (cell) starts from the same xhat and P.
+
+    The cells are filtered in blocks of size block, as banks of filters. With
+    workers > 1 the blocks are shared among a pool of processes, and Z (and
+    truth) are placed once in shared memory instead of being copied to
+    each worker.
+
+    It returns a structured array with one row per cell and the fields:
+    - q, r: indices of the cell in Qs and Rs.
+    - rmse: RMS error of the estimated states against the N-by-m truth, or
+      of the innovations if no truth is given.
+    - nis: average Normalized Innovation Squared per measurement (close to
+      1 for a consistent filter).
+    - nees: average Normalized Estimation Error Squared per state (only with
+      truth, otherwise 0).
+    - steps: number of steps run. With stop given, the cells whose average
+      NIS leaves [1/stop, stop] are stopped every check steps, and their
+      scores are those at that step.
+    """
+    Z = np.asarray(Z, dtype=float)
+    Qs, Rs = np.asarray(Qs, dtype=float), np.asarray(Rs, dtype=float)
+    truth = None if truth is None else np.asarray(truth, dtype=float)
+    model = (np.asarray(A, dtype=float), np.asarray(H, dtype=float), Qs, Rs,
+             np.asarray(xhat, dtype=float), np.asarray(P, dtype=float), check, stop)
+    cells = np.indices((len(Qs), len(Rs))).reshape((2,-1)).T
+    blocks = [cells[i:i+block] for i in range(0, len(cells), block)]
+    if workers > 1:
+        # Measurements and truth are copied once to shared memory
+        arrays = [('Z', Z)] if truth is None else [('Z', Z), ('truth', truth)]
+        shms, shared = [], []
+        try:
+            for key, data in arrays:
+                shm = shared_memory.SharedMemory(create=True, size=max(data.nbytes, 1))
+                shms.append(shm)
+                np.ndarray(data.shape, dtype=float, buffer=shm.buf)[:] = data
+                shared.append((key, shm.name, data.shape))
+            with mp.Pool(workers, initializer=_sweepAttach, initargs=(shared, model)) as pool:
+                scores = pool.map(_sweepBlock, blocks)
+        finally:
+            for shm in shms:
+                shm.close()
+                shm.unlink()
+    else:
+        scores = [_sweepRun(Z, truth, b, *model) for b in blocks]
+    scores = np.concatenate(scores)
+    table = np.zeros(len(cells), dtype=[('q', int), ('r', int), ('rmse', float),
+                                        ('nis', float), ('nees', float), ('steps', int)])
+    table['q'], table['r'] = cells[:,0], cells[:,1]
+    table['rmse'], table['nis'], table['nees'], table['steps'] = scores.T
+    return table
+
+
+def rtsSmoother(xhat, Z, A, P, Q, R, H, dtype=np.float64, method='inv'):
+    """
+    rtsSmoother estimates the states of a whole log of measurements with the
+    Rauch-Tung-Striebel smoother. Given the N-by-n array Z, the forward pass
+    runs kf (with the given update method) and the backward pass corrects
+    each filtered state with the smoothed state that follows it:
+        C_k  = P_k * A' * Pp_k+1^-1
+        xs_k = x_k + C_k * (xs_k+1 - A*x_k)
+        Ps_k = P_k + C_k * (Ps_k+1 - Pp_k+1) * C_k'
+    where Pp are the predicted covariances.
+
+    The filtered states and covariances are stored in preallocated N-by-m
+    and N-by-m-by-m arrays of the given dtype (e.g. np.float32 to halve the
+    memory), and overwritten by the smoothed ones, which are returned. The
+    Cholesky factors of the predicted covariances are stored during the
+    forward pass and reused in the backward pass, so that the memory is
+    fixed to N*(m + 2*m*m) elements.
+    """
+    Z = np.asarray(Z, dtype=float)
+    Z = Z.reshape((Z.shape[0], -1))
+    N = Z.shape[0]
+    m = len(xhat)
+    X  = np.empty((N, m), dtype=dtype)
+    Ps = np.empty((N, m, m), dtype=dtype)
+    Lp = np.empty((N, m, m), dtype=dtype)
+    xhat = np.asarray(xhat, dtype=float).reshape((m,1))
+    # Forward pass (Kalman Filter)
+    for i in range(N):
+        xhat = np.dot(A, xhat)
+        P    = np.dot(A, np.dot(P, A.T)) + Q
+        Lp[i] = np.linalg.cholesky(0.5*(P+P.T))
+        v    = Z[i].reshape((-1,1)) - np.dot(H, xhat)
+        xhat, P = kfUpdate(xhat, v, P, R, H, method)
+        X[i]  = xhat[:,0]
+        Ps[i] = P
+    # Backward pass
+    for i in range(N-2, -1, -1):
+        x_i = X[i].astype(float)
+        P_i = Ps[i].astype(float)
+        L   = Lp[i+1].astype(float)
+        # Smoother gain C = P_i * A' * Pp^-1, obtained as C' = Pp^-1 * A * P_i
+        Ct  = lin.cho_solve((L, True), np.dot(A, P_i), check_finite=False)
+        C   = Ct.T
+        X[i]  = x_i + np.dot(C, X[i+1] - np.dot(A, x_i))
+        Ps[i] = P_i + np.dot(C, np.dot(Ps[i+1] - np.dot(L, L.T), Ct))
+    return X, Ps
+
+
+def _sqrtPSD(M):
+    """
+    _sqrtPSD returns a factor L with L*L' = M of a symmetric positive
+    semi-definite matrix M. It is the Cholesky factor when M is positive
+    definite, or V*sqrt(w) from its eigenvalues w (clipped at zero) and
+    eigenvectors V otherwise, e.g. for a process noise with zero blocks.
+    """
+    M = 0.5*(M+np.transpose(M))
+    try:
+        return np.linalg.cholesky(M)
+    except np.linalg.LinAlgError:
+        w, V = np.linalg.eigh(M)
+        return V*np.sqrt(np.clip(w, 0.0, None))
+
+
+class SquareRootKF:
+    """
+    SquareRootKF is a linear Kalman Filter that propagates a lower
+    triangular factor S of the covariance (P = S*S') instead of P itself.
+    Both prediction and update triangularize an array of factors with a QR
+    decomposition, so P stays symmetric and positive semi-definite by
+    construction. This allows to run the filter in single precision
+    (dtype=np.float32) where the covariance form quickly breaks down.
+
+    It takes the same A, Q, R and H of kf (e.g. built with buildA, buildQ
+    and buildR). Q and R are factored only once, and may be singular (but
+    not the innovation covariance). Like kf, its steps return
+    the state and the covariance P (the factor is kept in the attribute S).
+
+    See:
+    - Kaminski, P., Bryson, A. and Schmidt, S. Discrete square root
+      filtering: A survey of current techniques. IEEE Transactions on
+      Automatic Control 16(6). 1971.
+    """
+    def __init__(self, xhat, P, A, Q, R, H, dtype=np.float64):
+        self.dtype = dtype
+        self.m = len(xhat)
+        self.xhat = np.array(xhat, dtype=dtype).reshape((self.m,1))
+        self.S  = np.linalg.cholesky(np.asarray(P, dtype=float)).astype(dtype)
+        self.A  = np.array(A, dtype=dtype)
+        self.H  = np.array(H, dtype=dtype)
+        self.Qs = _sqrtPSD(np.asarray(Q, dtype=float)).astype(dtype)
+        self.Rs = _sqrtPSD(np.asarray(R, dtype=float)).astype(dtype)
+        self.n  = self.H.shape[0]
+
+    @property
+    def P(self):
+        return np.dot(self.S, self.S.T)
+
+    def predict(self):
+        """predict propagates the state and the factor S of its covariance:
+            [A*S, Qs]' = Q_*R_   ->   S = R_'
+        """
+        self.xhat = np.dot(self.A, self.xhat)
+        M = np.hstack((np.dot(self.A, self.S), self.Qs))
+        self.S = np.linalg.qr(M.T, mode='r')[:self.m].T
+        return self.xhat, self.P
+
+    def update(self, z):
+        """update corrects the state with the measurements z triangularizing
+        the array:
+            | Rs  H*S |          | Se  0 |
+            | 0    S  | * Q_  =  | Kb  S |
+        where Se is the factor of the innovation covariance and the gain is
+        K = Kb*Se^-1.
+        """
+        m, n = self.m, self.n
+        M = np.zeros((n+m, n+m), dtype=self.dtype)
+        M[:n,:n] = self.Rs
+        M[:n,n:] = np.dot(self.H, self.S)
+        M[n:,n:] = self.S
+        L = np.linalg.qr(M.T, mode='r').T
+        Se = L[:n,:n]
+        Kb = L[n:,:n]
+        self.S = L[n:,n:]
+        v = np.asarray(z, dtype=self.dtype).reshape((n,1)) - np.dot(self.H, self.xhat)
+        self.xhat = self.xhat + np.dot(Kb, lin.solve_triangular(Se, v, lower=True))
+        return self.xhat, self.P
+
+    def step(self, z):
+        """step predicts and updates the filter with the measurements z."""
+        self.predict()
+        return self.update(z)
+
+
+def decouple(A, Q, R, H, axes=3):
+    """
+    decouple detects if a model with states ordered by blocks (e.g. the
+    9-states [positions, velocities, accelerations] of buildA) evolves and is
+    measured independently along each of the given axes. If so, it returns
+    the per-axis matrices A, Q, R and H as arrays with a leading dimension of
+    length axes, and the order of the measurements per axis. Otherwise it
+    returns None.
+    """
+    A, Q, R, H = [np.asarray(M, dtype=float) for M in (A, Q, R, H)]
+    m = A.shape[0]
+    # State indices of each axis, e.g. [[0,3,6], [1,4,7], [2,5,8]]
+    idx = np.arange(m).reshape((m//axes, axes)).T
+    # Measurements of each axis: rows of H touching only its states
+    rows = [np.flatnonzero(np.any(H[:,ix] != 0.0, axis=1)) for ix in idx]
+    if len(set(len(r) for r in rows)) != 1 or sum(len(r) for r in rows) != H.shape[0]:
+        return None
+    rows = np.array(rows)
+    # Cross terms between different axes must all be zero
+    mask = np.ones((m,m), dtype=bool)
+    mask_r = np.ones(R.shape, dtype=bool)
+    for a in range(axes):
+        mask[np.ix_(idx[a], idx[a])] = False
+        mask_r[np.ix_(rows[a], rows[a])] = False
+    if np.any(A[mask] != 0.0) or np.any(Q[mask] != 0.0) or np.any(R[mask_r] != 0.0):
+        return None
+    if any(np.any(H[np.ix_(rows[a], np.setdiff1d(np.arange(m), idx[a]))] != 0.0) for a in range(axes)):
+        return None
+    A_ax = np.array([A[np.ix_(ix, ix)] for ix in idx])
+    Q_ax = np.array([Q[np.ix_(ix, ix)] for ix in idx])
+    R_ax = np.array([R[np.ix_(r, r)] for r in rows])
+    H_ax = np.array([H[np.ix_(r, ix)] for r, ix in zip(rows, idx)])
+    return A_ax, Q_ax, R_ax, H_ax, rows
+
+
+class AxisKF:
+    """
+    AxisKF is a linear Kalman Filter for models that decouple per axis (see
+    decouple), like the constant acceleration model of buildA with diagonal
+    Q and R. It runs one small filter per axis (three 3-state filters instead
+    of a 9-state one) and gives the same estimates as kf.
+
+    Several objects can be filtered at once giving N-by-m states, N-by-m-by-m
+    covariances and N-by-n measurements. The filters of each axis are stacked
+    along the objects, and the covariances are kept flattened, so that the
+    prediction A*P*A^T is a single product with kron(A,A) per axis. With one
+    measurement per axis the gain needs no inversion.
+    """
+    def __init__(self, xhat, P, A, Q, R, H, axes=3):
+        parts = decouple(A, Q, R, H, axes)
+        if parts is None:
+            raise ValueError("The model does not decouple per axis")
+        A_ax, Q_ax, R_ax, H_ax, self.rows = parts
+        xhat = np.asarray(xhat, dtype=float)
+        self.single = xhat.ndim == 1 or xhat.shape[-1] == 1
+        xhat = xhat.reshape((-1, len(A)))
+        self.N, self.m = xhat.shape
+        self.k = self.m//axes
+        self.idx = np.arange(self.m).reshape((self.k, axes)).T
+        # States (axes, N, k) and flattened covariances (axes, N, k*k)
+        self.x = np.ascontiguousarray(np.swapaxes(xhat[:, self.idx], 0, 1))
+        P = np.broadcast_to(P, (self.N, self.m, self.m))
+        self.P = np.array([[Pn[np.ix_(ix, ix)].ravel() for Pn in P] for ix in self.idx])
+        # Per-axis models arranged to act on the rows of x and P
+        self.At = np.swapaxes(A_ax, -1, -2)
+        self.AAt = np.array([np.kron(Ai, Ai).T for Ai in A_ax])
+        self.Q = Q_ax.reshape((axes, 1, -1))
+        self.H, self.R = H_ax[:, None], R_ax[:, None]
+        self.Ht = np.swapaxes(H_ax, -1, -2)
+        self.HPt = np.array([np.kron(np.eye(self.k), Hi.T) for Hi in H_ax])
+
+    def step(self, z):
+        """step predicts and updates the filters with the measurements z, and
+        returns the estimated state (m-by-1, or N-by-m for several objects).
+        """
+        z = np.swapaxes(np.asarray(z, dtype=float).reshape((self.N, -1))[:, self.rows], 0, 1)
+        # KF - Prediction
+        x = np.matmul(self.x, self.At)
+        P = np.matmul(self.P, self.AAt) + self.Q
+        # KF - Update
+        PHt = np.matmul(P, self.HPt)
+        if z.shape[-1] == 1:
+            S = np.matmul(PHt, self.Ht) + self.R[..., 0]
+            K = PHt/S
+            self.x = x + K*(z - np.matmul(x, self.Ht))
+            self.P = P - (K[..., :, None]*PHt[..., None, :]).reshape(P.shape)
+        else:
+            PHt = PHt.reshape(PHt.shape[:2] + (self.k, -1))
+            S = np.matmul(self.H, PHt) + self.R
+            K = np.swapaxes(np.linalg.solve(S, np.swapaxes(PHt, -1, -2)), -1, -2)
+            v = z - np.matmul(x, self.Ht)
+            self.x = x + np.matmul(K, v[..., None])[..., 0]
+            self.P = P - np.matmul(K, np.swapaxes(PHt, -1, -2)).reshape(P.shape)
+        return self.xhat
+
+    @property
+    def xhat(self):
+        x = np.empty((self.N, self.m))
+        x[:, self.idx] = np.swapaxes(self.x, 0, 1)
+        return x.reshape((self.m, 1)) if self.single else x
+
+    @property
+    def Pfull(self):
+        P = np.zeros((self.N, self.m, self.m))
+        for a, ix in enumerate(self.idx):
+            P[:, ix[:,None], ix[None,:]] = self.P[a].reshape((self.N, self.k, self.k))
+        return P[0] if self.single else P
+
+
+class KalmanBank:
+    """
+    KalmanBank runs K linear Kalman Filters at once. The states are kept as
+    a K-by-m-by-1 array xhat and the covariances as a K-by-m-by-m array P.
+
+    Each of A, Q, R and H can be given per filter (with a leading dimension
+    K) or shared by all filters (a single matrix), as they are broadcasted.
+    The gains are obtained with batched solves of the innovation covariances
+    S instead of inverting them.
+    """
+    def __init__(self, xhat, P, A, Q, R, H):
+        self.xhat = np.array(xhat, dtype=float)
+        if self.xhat.ndim < 3:
+            self.xhat = self.xhat.reshape(self.xhat.shape + (1,))
+        self.K, self.m = self.xhat.shape[:2]
+        self.P = np.array(np.broadcast_to(P, (self.K, self.m, self.m)), dtype=float)
+        self.A = np.asarray(A, dtype=float)
+        self.Q = np.asarray(Q, dtype=float)
+        self.R = np.asarray(R, dtype=float)
+        self.H = np.asarray(H, dtype=float)
+
+    def predict(self):
+        """predict propagates the states and covariances of all filters."""
+        At = np.swapaxes(self.A, -1, -2)
+        self.xhat = np.matmul(self.A, self.xhat)
+        self.P = np.matmul(np.matmul(self.A, self.P), At) + self.Q
+        return self.xhat, self.P
+
+    def update(self, z):
+        """update corrects all filters with the K-by-n array of measurements
+        z (one row per filter).
+        """
+        z = np.asarray(z, dtype=float).reshape((self.K, -1, 1))
+        Ht = np.swapaxes(self.H, -1, -2)
+        PHt = np.matmul(self.P, Ht)
+        S  = np.matmul(self.H, PHt) + self.R
+        # K = P * H^T * S^-1 is obtained as K^T = S^-T * (P * H^T)^T
+        St = np.swapaxes(np.broadcast_to(S, (self.K,)+S.shape[-2:]), -1, -2)
+        Kt = np.linalg.solve(St, np.swapaxes(PHt, -1, -2))
+        v  = z - np.matmul(self.H, self.xhat)
+        self.xhat = self.xhat + np.matmul(np.swapaxes(Kt, -1, -2), v)
+        self.P = self.P - np.matmul(np.swapaxes(Kt, -1, -2), np.matmul(self.H, self.P))
+        return self.xhat, self.P
+
+    def step(self, z):
+        """step predicts and updates all filters with the measurements z."""
+        self.predict()
+        return self.update(z)
+
+    def run(self, Z):
+        """run filters an N-by-K-by-n array of measurements and returns the
+        N-by-K-by-m array of estimated states.
+        """
+        Z = np.asarray(Z, dtype=float)
+        X = np.empty((Z.shape[0], self.K, self.m))
+        for i in range(Z.shape[0]):
+            self.step(Z[i])
+            X[i] = self.xhat[...,0]
+        return X
+
+
+class MultiTracker:
+    """
+    MultiTracker follows many objects with unlabeled detections using the
+    linear model A, Q, R, H of kf.
+
+    The tracks live in a pool of arrays (states X, covariances P, ids, hits
+    and misses) that grows by doubling; the flag array alive marks the slots
+    in use. Every frame:
+
+    1. The alive tracks are predicted at once.
+    2. Candidate pairs are found with a KD-tree of the detections, using as
+       radius the largest Euclidean distance allowed by the Mahalanobis gate
+       of each track (gate * max eigenvalue of S).
+    3. The candidates are gated with their Mahalanobis distance and assigned
+       with the Hungarian method per connected group of tracks and
+       detections ('hungarian') or greedily by distance ('gnn').
+    4. The assigned tracks are updated, a new track is born from each
+       unassigned detection and tracks missed more than max_misses times in
+       a row are removed.
+
+    Tracks are confirmed after confirm hits. New tracks start at x0 + H^+ z
+    with covariance P0.
+    """
+    def __init__(self, A, Q, R, H, P0, x0=None, gate=0.999, method='hungarian',
+                 max_misses=3, confirm=3, capacity=64):
+        self.A = np.asarray(A, dtype=float)
+        self.Q = np.asarray(Q, dtype=float)
+        self.R = np.asarray(R, dtype=float)
+        self.H = np.asarray(H, dtype=float)
+        self.m, self.n = self.A.shape[0], self.H.shape[0]
+        self.P0 = np.asarray(P0, dtype=float)
+        self.x0 = np.zeros(self.m) if x0 is None else np.asarray(x0, dtype=float).ravel()
+        self.Hpinv = np.linalg.pinv(self.H)
+        # Gate given as probability is turned into a chi-square threshold
+        self.gate = chi2.ppf(gate, self.n) if gate < 1.0 else float(gate)
+        self.method = method
+        self.max_misses, self.confirm = max_misses, confirm
+        self.next_id = 0
+        self.X = np.zeros((capacity, self.m))
+        self.P = np.zeros((capacity, self.m, self.m))
+        self.ids = np.full(capacity, -1)
+        self.hits = np.zeros(capacity, dtype=int)
+        self.misses = np.zeros(capacity, dtype=int)
+        self.alive = np.zeros(capacity, dtype=bool)
+
+    def _grow(self, size):
+        """_grow enlarges the pool to hold at least size tracks."""
+        capacity = len(self.alive)
+        while capacity < size:
+            capacity *= 2
+        extra = capacity - len(self.alive)
+        self.X = np.concatenate((self.X, np.zeros((extra, self.m))))
+        self.P = np.concatenate((self.P, np.zeros((extra, self.m, self.m))))
+        self.ids = np.concatenate((self.ids, np.full(extra, -1)))
+        self.hits = np.concatenate((self.hits, np.zeros(extra, dtype=int)))
+        self.misses = np.concatenate((self.misses, np.zeros(extra, dtype=int)))
+        self.alive = np.concatenate((self.alive, np.zeros(extra, dtype=bool)))
+
+    def _birth(self, Z):
+        """_birth starts a track for each row of the detections Z."""
+        free = np.flatnonzero(~self.alive)
+        if len(free) < len(Z):
+            self._grow(np.count_nonzero(self.alive) + len(Z))
+            free = np.flatnonzero(~self.alive)
+        slots = free[:len(Z)]
+        self.X[slots] = self.x0 + np.dot(Z, self.Hpinv.T)
+        self.P[slots] = self.P0
+        self.ids[slots] = np.arange(self.next_id, self.next_id+len(Z))
+        self.next_id += len(Z)
+        self.hits[slots] = 1
+        self.misses[slots] = 0
+        self.alive[slots] = True
+
+    def _associate(self, Zp, S, Z):
+        """_associate returns the pairs (track, detection) assigned among
+        the predicted measurements Zp with covariances S and detections Z.
+        """
+        empty = np.zeros(0, dtype=int)
+        if len(Zp) == 0 or len(Z) == 0:
+            return empty, empty
+        # Euclidean radius containing each Mahalanobis gate
+        radius = np.sqrt(self.gate*np.linalg.eigvalsh(S)[:,-1])
+        candidates = cKDTree(Z).query_ball_point(Zp, radius)
+        rows = np.repeat(np.arange(len(Zp)), [len(c) for c in candidates])
+        cols = np.fromiter((j for c in candidates for j in c), dtype=int, count=len(rows))
+        # Mahalanobis distances of the candidate pairs
+        v = Z[cols] - Zp[rows]
+        d2 = np.einsum('ij,ij->i', v, np.linalg.solve(S[rows], v[...,None])[...,0])
+        inside = d2 <= self.gate
+        rows, cols, d2 = rows[inside], cols[inside], d2[inside]
+        if len(rows) == 0:
+            return empty, empty
+        if self.method == 'gnn':
+            used_t = np.zeros(len(Zp), dtype=bool)
+            used_z = np.zeros(len(Z), dtype=bool)
+            pairs = []
+            for k in np.argsort(d2):
+                if not (used_t[rows[k]] or used_z[cols[k]]):
+                    used_t[rows[k]] = used_z[cols[k]] = True
+                    pairs.append((rows[k], cols[k]))
+            return tuple(np.array(p, dtype=int) for p in zip(*pairs))
+        # Hungarian assignment on each connected group of tracks and detections
+        T = len(Zp)
+        graph = coo_matrix((np.ones(len(rows)), (rows, T+cols)), shape=(T+len(Z),)*2)
+        _, labels = connected_components(graph, directed=False)
+        group = labels[rows]
+        # Groups with a single candidate pair are assigned directly
+        single = np.bincount(group)[group] == 1
+        assigned_t, assigned_z = [rows[single]], [cols[single]]
+        rows, cols, d2, group = rows[~single], cols[~single], d2[~single], group[~single]
+        order = np.argsort(group, kind='stable')
+        splits = np.flatnonzero(np.diff(group[order])) + 1
+        for block in np.split(order, splits) if len(order) else []:
+            tr, zr = np.unique(rows[block]), np.unique(cols[block])
+            # Pairs outside the gate cost more than any gated assignment
+            outside = 2.0*self.gate*len(block)
+            C = np.full((len(tr), len(zr)), outside)
+            C[np.searchsorted(tr, rows[block]), np.searchsorted(zr, cols[block])] = d2[block]
+            i, j = linear_sum_assignment(C)
+            valid = C[i, j] < outside
+            assigned_t.append(tr[i[valid]])
+            assigned_z.append(zr[j[valid]])
+        return np.concatenate(assigned_t), np.concatenate(assigned_z)
+
+    def step(self, Z):
+        """step processes the M-by-n array of detections Z of one frame and
+        returns the ids and states of the confirmed tracks.
+        """
+        Z = np.asarray(Z, dtype=float).reshape((-1, self.n))
+        slots = np.flatnonzero(self.alive)
+        # Prediction of all alive tracks
+        X = np.dot(self.X[slots], self.A.T)
+        P = np.matmul(np.matmul(self.A, self.P[slots]), self.A.T) + self.Q
+        # Association
+        PHt = np.matmul(P, self.H.T)
+        S = np.matmul(self.H, PHt) + self.R
+        ti, zi = self._associate(np.dot(X, self.H.T), S, Z)
+        # Update of the assigned tracks
+        if len(ti):
+            Kt = np.linalg.solve(np.swapaxes(S[ti], -1, -2), np.swapaxes(PHt[ti], -1, -2))
+            K = np.swapaxes(Kt, -1, -2)
+            v = Z[zi] - np.dot(X[ti], self.H.T)
+            X[ti] += np.matmul(K, v[...,None])[...,0]
+            P[ti] -= np.matmul(K, np.swapaxes(PHt[ti], -1, -2))
+        self.X[slots], self.P[slots] = X, P
+        hit = np.zeros(len(slots), dtype=bool)
+        hit[ti] = True
+        self.hits[slots[hit]] += 1
+        self.misses[slots[hit]] = 0
+        self.misses[slots[~hit]] += 1
+        # Death of the lost tracks and birth of the unassigned detections
+        self.alive[slots[self.misses[slots] > self.max_misses]] = False
+        free_z = np.ones(len(Z), dtype=bool)
+        free_z[zi] = False
+        self._birth(Z[free_z])
+        return self.tracks()
+
+    def tracks(self, confirmed=True):
+        """tracks returns the ids and states of the (confirmed) tracks."""
+        keep = self.alive & (self.hits >= self.confirm) if confirmed else self.alive
+        return self.ids[keep], self.X[keep]
 
 
 def buildF(dt):
@@ -149,8 +1126,282 @@ def buildQ(qc,F,dt):
     Qc  = np.eye(m)*qc
     Phi = np.vstack((np.hstack((F, Qc)),np.hstack((np.zeros((m,m)),-F.T))))
     CD  = np.dot(lin.expm(np.dot(Phi,dt)),np.vstack((np.zeros((m,m)),np.eye(m))))
-    return lin.solve(CD[m::,:],CD[0:m,:])
+    # Q = C*D^-1 (Matrix Fraction Decomposition)
+    return lin.solve(CD[m::,:].T,CD[0:m,:].T).T
+
+
+def buildQca(qc,dt):
+    """
+    buildQca creates the 9-by-9 Process Noise matrix Q of the constant
+    acceleration model encoded by buildA in closed form, given the 9-vector
+    qc with the spectral densities of the noise of positions, velocities and
+    accelerations. It is the solution of:
+        Q = int_0^dt expm(F*s) * Qc * expm(F*s)' ds
+    with the continuous model F = [0 I 0; 0 0 I; 0 0 0].
+    """
+    qc  = np.asarray(qc, dtype=float)
+    a, b, c = qc[0:3], qc[3:6], qc[6:9]
+    dt2 = dt*dt
+    dt3 = dt2*dt
+    Q   = np.zeros((9,9))
+    i   = np.arange(3)
+    Q[i,i]     = a*dt + b*dt3/3.0 + c*dt3*dt2/20.0
+    Q[i,i+3]   = b*dt2/2.0 + c*dt2*dt2/8.0
+    Q[i,i+6]   = c*dt3/6.0
+    Q[i+3,i+3] = b*dt + c*dt3/3.0
+    Q[i+3,i+6] = c*dt2/2.0
+    Q[i+6,i+6] = c*dt
+    Q[i+3,i]   = Q[i,i+3]
+    Q[i+6,i]   = Q[i,i+6]
+    Q[i+6,i+3] = Q[i+3,i+6]
+    return Q
+
+
+class Discretizer:
+    """
+    Discretizer gives the transition matrix A and the process noise Q of the
+    constant acceleration model for any sample rate dt, e.g. for streams
+    with jittery timestamps.
+
+    The sample rates are quantized to the given resolution (in seconds) and
+    the pair (A, Q) of each quantized rate is kept in a bounded LRU cache of
+    maxsize entries. With closed_form=False, Q is computed with buildQ and
+    the continuous model matrix of buildA (Van Loan's method); otherwise with
+    buildQca. Both give the same Q.
+    The counters hits and misses tell how the cache is doing.
+    """
+    def __init__(self, qc, resolution=1e-6, maxsize=256, closed_form=False):
+        self.qc = np.asarray(qc, dtype=float)
+        self.resolution = resolution
+        self.maxsize = maxsize
+        self.closed_form = closed_form
+        # Continuous model of buildA: d/dt [p, v, a] = [v, a, 0]
+        self.F = np.kron(np.eye(3, k=1), np.eye(3))
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, dt):
+        key = int(round(dt/self.resolution))
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+        self.misses += 1
+        dt = key*self.resolution
+        if self.closed_form:
+            AQ = (buildA(dt), buildQca(self.qc, dt))
+        else:
+            AQ = (buildA(dt), buildQ(self.qc, self.F, dt))
+        self.cache[key] = AQ
+        if len(self.cache) > self.maxsize:
+            self.cache.popitem(last=False)
+        return AQ
+
+    def clear(self):
+        self.cache.clear()
+        self.hits = 0
+        self.misses = 0
+
+
+
+class FusionScheduler:
+    """
+    FusionScheduler fuses sensors reporting at different rates into the
+    constant acceleration model, driven by their measurements instead of a
+    fixed clock.
+
+    The sensors are given as a dictionary {name: (H, R)} with the rows of the
+    measurement matrix H (k-by-m) and the noise R (k-by-k) of each sensor.
+    Measurements are pushed with their timestamps into a time-ordered queue.
+    When processed, the state is predicted over the elapsed time since the
+    last one in a single step, with A and Q given by a Discretizer built with
+    qc (or the given one), and updated only with the rows of the sensor that
+    reported. Thus the cost grows with the number of measurements, not with
+    the rate of the fastest sensor.
+
+    Measurements older than the last processed one are dropped and counted
+    in late.
+    """
+    def __init__(self, xhat, P, sensors, qc=None, t0=0.0, discretizer=None):
+        self.xhat = np.array(xhat, dtype=float).reshape((-1,1))
+        self.P = np.array(P, dtype=float)
+        self.sensors = dict((name, (np.atleast_2d(np.asarray(H, dtype=float)), np.atleast_2d(np.asarray(R, dtype=float))))
+                            for name, (H, R) in sensors.items())
+        if qc is None and discretizer is None:
+            raise ValueError("FusionScheduler needs the noise densities qc or a discretizer")
+        self.discretizer = Discretizer(qc) if discretizer is None else discretizer
+        self.t = t0
+        self.queue = []
+        self.count = 0
+        self.predictions = 0
+        self.late = 0
+
+    def push(self, t, sensor, z):
+        """push adds the measurement z of the sensor taken at time t."""
+        if sensor not in self.sensors:
+            raise KeyError("Unknown sensor '%s'" % sensor)
+        heapq.heappush(self.queue, (t, self.count, sensor, np.asarray(z, dtype=float)))
+        self.count += 1
 
+    def _predict(self, t):
+        """_predict returns the state and covariance propagated until t."""
+        A, Q = self.discretizer(t - self.t)
+        return np.dot(A, self.xhat), np.dot(A, np.dot(self.P, A.T)) + Q
+
+    def process(self, until=None):
+        """process fuses the queued measurements taken until the given time
+        (all of them by default) in chronological order.
+        """
+        while self.queue and (until is None or self.queue[0][0] <= until):
+            t, _, sensor, z = heapq.heappop(self.queue)
+            if t < self.t:
+                self.late += 1
+                continue
+            if t > self.t:
+                self.xhat, self.P = self._predict(t)
+                self.predictions += 1
+                self.t = t
+            H, R = self.sensors[sensor]
+            v = z.reshape((-1,1)) - np.dot(H, self.xhat)
+            self.xhat, self.P = kfUpdate(self.xhat, v, self.P, R, H)
+        return self.xhat, self.P
+
+    def state(self, t):
+        """state returns the estimated state and covariance at time t, after
+        fusing the measurements taken until then. The prediction to t is not
+        stored, so measurements arriving later are still fused in order.
+        """
+        self.process(until=t)
+        if t > self.t:
+            return self._predict(t)
+        return self.xhat, self.P
+
+
+def toInformation(xhat, P):
+    """
+    toInformation returns the information matrix Y = P^-1 and the information
+    vector y = P^-1*xhat of the state xhat with covariance P.
+    """
+    Y = lin.cho_solve(lin.cho_factor(P), np.eye(len(P)))
+    return Y, np.dot(Y, np.reshape(xhat, (-1,1)))
+
+
+def fromInformation(Y, y):
+    """
+    fromInformation returns the state xhat (m-by-1) and its covariance P of
+    the information matrix Y and the information vector y.
+    """
+    P = lin.cho_solve(lin.cho_factor(Y), np.eye(len(Y)))
+    return np.dot(P, np.reshape(y, (-1,1))), P
+
+
+class InformationFilter:
+    """
+    InformationFilter is the linear Kalman Filter in information form. It
+    keeps the information matrix Y = P^-1 and vector y = P^-1*xhat, so that
+    the measurements of many sensors are fused by adding their contributions:
+        Y = Y + sum( H_s^T * R_s^-1 * H_s )
+        y = y + sum( H_s^T * R_s^-1 * z_s )
+    instead of inverting the innovation covariance S of all stacked sensors.
+
+    The sensors are given as a dictionary {name: (H, R)}. Their terms
+    H^T*R^-1*H and H^T*R^-1 are computed once, and their sums for each set
+    of reporting sensors are cached, so an update costs a single product
+    growing linearly with the number of measurements. The prediction needs
+    the covariance form, with a cost independent of the sensors.
+
+    The properties xhat and P give the state in covariance form.
+    """
+    def __init__(self, xhat, P, A, Q, sensors):
+        self.Y, self.y = toInformation(xhat, P)
+        self.A = np.asarray(A, dtype=float)
+        self.Q = np.asarray(Q, dtype=float)
+        self.sensors = {}
+        for name, (H, R) in sensors.items():
+            H = np.atleast_2d(np.asarray(H, dtype=float))
+            HtRinv = lin.solve(np.atleast_2d(R), H, assume_a='pos').T
+            self.sensors[name] = (np.dot(HtRinv, H), HtRinv)
+        self.cache = {}
+
+    @property
+    def xhat(self):
+        return fromInformation(self.Y, self.y)[0]
+
+    @property
+    def P(self):
+        return fromInformation(self.Y, self.y)[1]
+
+    def predict(self):
+        """predict propagates the information matrix and vector."""
+        xhat, P = fromInformation(self.Y, self.y)
+        self.Y, self.y = toInformation(np.dot(self.A, xhat), np.dot(self.A, np.dot(P, self.A.T)) + self.Q)
+        return self.Y, self.y
+
+    def _contributions(self, names):
+        """_contributions returns the sum of H^T*R^-1*H and the stacked
+        H^T*R^-1 of the given sensors.
+        """
+        if names not in self.cache:
+            self.cache[names] = (sum(self.sensors[s][0] for s in names),
+                                 np.hstack([self.sensors[s][1] for s in names]))
+        return self.cache[names]
+
+    def update(self, measurements):
+        """update fuses the dictionary of measurements {name: z} of the
+        sensors that reported.
+        """
+        names = tuple(sorted(measurements))
+        HtRinvH, HtRinv = self._contributions(names)
+        z = np.concatenate([np.ravel(measurements[s]) for s in names])
+        self.Y = self.Y + HtRinvH
+        self.y = self.y + np.dot(HtRinv, z).reshape((-1,1))
+        return self.Y, self.y
+
+    def step(self, measurements):
+        """step predicts and fuses the measurements {name: z}."""
+        self.predict()
+        return self.update(measurements)
+
+
+class ExtendedInformationFilter(InformationFilter):
+    """
+    ExtendedInformationFilter is the information form of the EKF. The process
+    model f and the measurement models h of the sensors {name: (h, R)} work
+    on columns of states as in ekf. Each sensor is linearized with jacobian
+    at the predicted state x, and adds:
+        Y = Y + H^T * R^-1 * H
+        y = y + H^T * R^-1 * (z - h(x) + H*x)
+    The inverses of the R are computed once.
+    """
+    def __init__(self, xhat, P, f, Q, sensors, eps=1e-6):
+        self.Y, self.y = toInformation(xhat, P)
+        self.f = f
+        self.Q = np.asarray(Q, dtype=float)
+        self.eps = eps
+        self.sensors = dict((name, (h, lin.inv(np.atleast_2d(R)))) for name, (h, R) in sensors.items())
+
+    def predict(self):
+        """predict propagates the information through the process model."""
+        xhat, P = fromInformation(self.Y, self.y)
+        xhat, F = jacobian(self.f, xhat, self.eps)
+        self.Y, self.y = toInformation(xhat, np.dot(F, np.dot(P, F.T)) + self.Q)
+        return self.Y, self.y
+
+    def update(self, measurements):
+        """update fuses the dictionary of measurements {name: z} of the
+        sensors that reported, linearized at the current state.
+        """
+        x = fromInformation(self.Y, self.y)[0]
+        dY, dy = np.zeros_like(self.Y), np.zeros_like(self.y)
+        for name, z in measurements.items():
+            h, Rinv = self.sensors[name]
+            hx, H = jacobian(h, x, self.eps)
+            HtRinv = np.dot(H.T, Rinv)
+            dY += np.dot(HtRinv, H)
+            dy += np.dot(HtRinv, np.reshape(z, (-1,1)) - hx + np.dot(H, x))
+        self.Y, self.y = self.Y + dY, self.y + dy
+        return self.Y, self.y
 
 
 ## TEST FUNCTIONS ##
@@ -164,17 +1415,579 @@ class bcolors:
     FAIL = '\033[91m'       # FAIL message (Red)
     ENDC = '\033[0m'        # End formatting
 
-# PENDING!!
-# TODO: Test functions for the above script.
+def assertTest(condition=False, text=""):
+    line_length = 54
+    if condition:
+        result_text = " [ " + bcolors.OKGR + "OK" + bcolors.ENDC + " ]"
+    else:
+        result_text = " [ " + bcolors.FAIL + "NO" + bcolors.ENDC + " ]"
+    print("- " + text + " " + "."*(line_length-len(text)-1) + result_text)
+
+
+def test_KalmanBank(debug=False):
+    """
+    Test that a bank of filters gives the same estimations as running kf for
+    each filter separately.
+    """
+    K, N, dt = 20, 100, 0.01
+    A = buildA(dt)
+    H = np.hstack((np.eye(3), np.zeros((3,6))))
+    Q = buildQ(np.ones(9)*0.1, buildF(dt), dt)
+    R = np.array([buildR(np.random.random(3)) for k in range(K)])
+    Z = np.cumsum(np.random.normal(0.0, 1.0, (N,K,3)), axis=0)
+    bank = KalmanBank(np.zeros((K,9)), np.eye(9), A, Q, R, H)
+    X = bank.run(Z)
+    max_diff = 0.0
+    for k in range(K):
+        xhat, P = np.zeros((9,1)), np.eye(9)
+        for i in range(N):
+            xhat, P = kf(xhat, Z[i,k], A, P, Q, R[k], H)
+            max_diff = max(max_diff, np.max(abs(X[i,k]-xhat[:,0])/(1.0+abs(xhat[:,0]))))
+    if debug:
+        print("----------------------------------------------------------------------")
+        print("Max. relative difference =", max_diff)
+    assertTest( max_diff < 1e-9 , "Bank of Kalman Filters")
+
+
+def test_SteadyState(debug=False):
+    """
+    Test that the steady-state Kalman Filter converges to the same estimates
+    of the complete Kalman Filter.
+    """
+    N, dt = 2000, 0.01
+    A = buildA(dt)
+    H = np.hstack((np.eye(3), np.zeros((3,6))))
+    Q = buildQ(np.ones(9), buildF(dt), dt)
+    Q = 0.5*(Q+Q.T)
+    R = buildR(np.ones(3)*0.1)
+    Z = np.cumsum(np.random.normal(0.0, 0.1, (N,3)), axis=0)
+    X, P = kfRun(np.zeros(9), Z, A, np.eye(9), Q, R, H)
+    X_dare, P_dare = kfRun(np.zeros(9), Z, A, np.eye(9), Q, R, H, steady='dare')
+    X_auto, P_auto = kfRun(np.zeros(9), Z, A, np.eye(9), Q, R, H, steady='auto')
+    if debug:
+        print("----------------------------------------------------------------------")
+        print("Difference of last estimates (DARE) =", np.max(abs(X[-1]-X_dare[-1])))
+        print("Max. difference (Auto)              =", np.max(abs(X-X_auto)))
+    assertTest( np.allclose(P, P_dare) , "Steady-state covariance from DARE")
+    assertTest( np.allclose(X[-100:], X_dare[-100:], atol=1e-6) , "Steady-state Kalman Filter")
+    assertTest( np.allclose(X, X_auto) , "Automatic switch to steady-state")
+    try:
+        kfRun(np.zeros(9), Z, A, np.eye(9), Q, R, H, steady='DARE')
+        rejected = False
+    except ValueError:
+        rejected = True
+    assertTest( rejected , "Unknown steady-state option rejected")
+
+
+def test_Update(debug=False):
+    """
+    Test that the update methods of the Kalman Filter give the same
+    estimates.
+    """
+    N, dt = 200, 0.01
+    A = buildA(dt)
+    H = np.hstack((np.eye(3), np.zeros((3,6))))
+    Q = buildQ(np.ones(9), buildF(dt), dt)
+    Q = 0.5*(Q+Q.T)
+    R = buildR(np.random.random(3))
+    Z = np.cumsum(np.random.normal(0.0, 0.1, (N,3)), axis=0)
+    estimates = {}
+    for method in ['inv', 'cholesky', 'sequential']:
+        xhat, P = np.zeros((9,1)), np.eye(9)
+        for i in range(N):
+            xhat, P = kf(xhat, Z[i], A, P, Q, R, H, method)
+        estimates[method] = xhat, P
+    x_inv, P_inv = estimates['inv']
+    if debug:
+        print("----------------------------------------------------------------------")
+        for method in ['cholesky', 'sequential']:
+            print("Max. difference (%s) =" % method, np.max(abs(estimates[method][0]-x_inv)))
+    assertTest( all([np.allclose(x, x_inv) and np.allclose(P, P_inv) for x, P in estimates.values()]) , "Update methods of the Kalman Filter")
+
+
+def test_SquareRoot(debug=False):
+    """
+    Test that the Square-Root Kalman Filter gives the estimates of kf and
+    that it keeps a valid covariance in single precision.
+    """
+    N, dt = 2000, 0.01
+    A = buildA(dt)
+    H = np.hstack((np.eye(3), np.zeros((3,6))))
+    Q = buildQ(np.ones(9)*0.01, buildF(dt), dt)
+    Q = 0.5*(Q+Q.T)
+    R = buildR(np.ones(3)*0.01)
+    Z = np.cumsum(np.random.normal(0.0, 0.1, (N,3)), axis=0)
+    srkf64 = SquareRootKF(np.zeros(9), np.eye(9), A, Q, R, H)
+    srkf32 = SquareRootKF(np.zeros(9), np.eye(9), A, Q, R, H, dtype=np.float32)
+    xhat, P = np.zeros((9,1)), np.eye(9)
+    max_diff, max_diff32 = 0.0, 0.0
+    for i in range(N):
+        xhat, P = kf(xhat, Z[i], A, P, Q, R, H)
+        xhat64, P64 = srkf64.step(Z[i])
+        max_diff = max(max_diff, np.max(abs(xhat64-xhat)))
+        max_diff32 = max(max_diff32, np.max(abs(srkf32.step(Z[i])[0]-xhat)))
+    min_eig32 = np.min(np.linalg.eigvalsh(srkf32.P.astype(float)))
+    if debug:
+        print("----------------------------------------------------------------------")
+        print("Max. difference (float64) =", max_diff)
+        print("Max. difference (float32) =", max_diff32)
+        print("Min. eigenvalue of P (float32) =", min_eig32)
+    assertTest( max_diff < 1e-9 , "Square-Root Kalman Filter")
+    assertTest( srkf32.xhat.dtype == np.float32 and min_eig32 >= 0.0 , "Square-Root Kalman Filter in single precision")
+    assertTest( np.allclose(srkf64.P, P) and np.allclose(P64, P) , "Covariance of Square-Root Kalman Filter")
+    # Singular process noise (no noise in positions and velocities)
+    Q0 = lin.block_diag(np.zeros((6,6)), np.eye(3)*1e-3)
+    srkf0 = SquareRootKF(np.zeros(9), np.eye(9), A, Q0, R, H)
+    xhat, P = np.zeros((9,1)), np.eye(9)
+    for i in range(100):
+        xhat, P = kf(xhat, Z[i], A, P, Q0, R, H)
+        xhat0, P0 = srkf0.step(Z[i])
+    assertTest( np.allclose(xhat0, xhat) and np.allclose(P0, P) , "Square-Root Kalman Filter with singular Q")
+
+
+def test_Smoother(debug=False):
+    """
+    Test that the RTS smoother improves the estimates of the Kalman Filter
+    on a simulated trajectory, in double and single precision.
+    """
+    N, dt = 1000, 0.01
+    A = buildA(dt)
+    H = np.hstack((np.eye(3), np.zeros((3,6))))
+    Q = buildQ(np.ones(9)*0.1, buildF(dt), dt)
+    Q = 0.5*(Q+Q.T)
+    R = buildR(np.ones(3)*0.01)
+    t = np.arange(N)*dt
+    true_pos = np.column_stack((np.sin(t), np.cos(2.0*t), t))
+    Z = true_pos + np.random.normal(0.0, 0.1, (N,3))
+    X_kf, P_kf = kfRun(np.zeros(9), Z, A, np.eye(9), Q, R, H)
+    X, Ps = rtsSmoother(np.zeros(9), Z, A, np.eye(9), Q, R, H)
+    X32, Ps32 = rtsSmoother(np.zeros(9), Z, A, np.eye(9), Q, R, H, dtype=np.float32)
+    rmse_kf = np.sqrt(np.mean((X_kf[100:,:3]-true_pos[100:])**2))
+    rmse_rts = np.sqrt(np.mean((X[100:,:3]-true_pos[100:])**2))
+    if debug:
+        print("----------------------------------------------------------------------")
+        print("RMSE Kalman Filter =", rmse_kf)
+        print("RMSE RTS Smoother  =", rmse_rts)
+    assertTest( rmse_rts < rmse_kf and np.allclose(X[-1], X_kf[-1]) , "RTS Smoother")
+    assertTest( X32.dtype == np.float32 and np.allclose(X32, X, atol=1e-3) , "RTS Smoother in single precision")
+
+
+def test_Discretizer(debug=False):
+    """
+    Test the closed form of the process noise against Van Loan's method and
+    the cache of discretized models.
+    """
+    qc = np.random.random(9)
+    F = np.kron(np.eye(3, k=1), np.eye(3))               # Continuous constant acceleration model
+    dts = 0.01 + np.random.normal(0.0, 1e-4, 1000)
+    disc = Discretizer(qc, resolution=1e-5, maxsize=10)
+    for dt in dts:
+        A, Q = disc(dt)
+    dt = round(dts[-1]/1e-5)*1e-5
+    Q_vl = buildQ(qc, F, 0.01)
+    Q_cf = buildQca(qc, 0.01)
+    if debug:
+        print("----------------------------------------------------------------------")
+        print("Max. difference of Q =", np.max(abs(Q_vl-Q_cf)))
+        print("Cache hits = %d, misses = %d" % (disc.hits, disc.misses))
+    assertTest( np.allclose(Q_vl, Q_cf, rtol=1e-9, atol=1e-15) , "Closed form of process noise")
+    assertTest( np.allclose(Q_vl, Q_vl.T, rtol=1e-12, atol=1e-15) , "Symmetric process noise")
+    assertTest( disc.hits+disc.misses == len(dts) and len(disc.cache) <= 10 , "Cache of discretized models")
+    assertTest( np.allclose(A, buildA(dt)) and np.allclose(Q, buildQca(qc, dt), rtol=1e-9, atol=1e-15) ,
+                "Discretized model of the cache")
+
+
+def test_EKF(debug=False):
+    """
+    Test that the EKF of a linear model gives the estimates of kf, and that
+    it tracks the position of a target observed with range and bearing.
+    """
+    N, dt = 200, 0.1
+    A = buildA(dt)
+    H = np.hstack((np.eye(3), np.zeros((3,6))))
+    Q = buildQca(np.ones(9)*0.01, dt)
+    R = buildR(np.ones(3)*0.01)
+    Z = np.cumsum(np.random.normal(0.0, 0.1, (N,3)), axis=0)
+    xhat, P = np.zeros((9,1)), np.eye(9)
+    x_ekf, P_ekf = xhat, P
+    for i in range(N):
+        xhat, P = kf(xhat, Z[i], A, P, Q, R, H)
+        x_ekf, P_ekf = ekf(x_ekf, Z[i], lambda X: np.dot(A, X), P_ekf, Q, R, lambda X: np.dot(H, X))
+    # Nonlinear measurements: range and bearing of a planar position
+    Ac = buildA(dt)[np.ix_([0,1,3,4,6,7],[0,1,3,4,6,7])]
+    h = lambda X: np.vstack((np.hypot(X[0], X[1]), np.arctan2(X[1], X[0])))
+    t = np.arange(N)*dt
+    true_pos = np.vstack((10.0+np.cos(t), 5.0+np.sin(t)))
+    Zn = h(true_pos).T + np.random.normal(0.0, [0.05, 0.005], (N,2))
+    ekf_cached = EKF([10.0, 5.0, 0.0, 0.0, 0.0, 0.0], np.eye(6), lambda X: np.dot(Ac, X), h,
+                     np.eye(6)*1e-3, np.diag([0.05, 0.005])**2, reuse=0.05)
+    X = np.array([ekf_cached.step(z)[0][:2,0] for z in Zn])
+    rmse = np.sqrt(np.mean((X[50:]-true_pos[:,50:].T)**2))
+    if debug:
+        print("----------------------------------------------------------------------")
+        print("Max. difference with kf =", np.max(abs(x_ekf-xhat)))
+        print("RMSE of nonlinear EKF   =", rmse)
+    assertTest( np.allclose(x_ekf, xhat, atol=1e-5) , "EKF with linear models")
+    assertTest( rmse < 0.1 , "EKF with nonlinear measurements")
+
+
+def test_UKF(debug=False):
+    """
+    Test that the UKF of a linear model gives the estimates of kf, that a
+    bank of UKFs gives the estimates of each UKF, and that it tracks the
+    position of a target observed with range and bearing.
+    """
+    N, dt = 100, 0.1
+    A = buildA(dt)
+    H = np.hstack((np.eye(3), np.zeros((3,6))))
+    Q = buildQca(np.ones(9)*0.01, dt)
+    R = buildR(np.ones(3)*0.01)
+    Z = np.cumsum(np.random.normal(0.0, 0.1, (N,3)), axis=0)
+    ukf = UKF(np.zeros(9), np.eye(9), lambda X: np.dot(A, X), lambda X: np.dot(H, X), Q, R, alpha=1.0)
+    ukf_redraw = UKF(np.zeros(9), np.eye(9), lambda X: np.dot(A, X), lambda X: np.dot(H, X), Q, R, alpha=1.0, redraw=True)
+    xhat, P = np.zeros((9,1)), np.eye(9)
+    for i in range(N):
+        xhat, P = kf(xhat, Z[i], A, P, Q, R, H)
+        x_ukf, P_ukf = ukf.step(Z[i])
+        x_redraw, P_redraw = ukf_redraw.step(Z[i])
+    # Bank of nonlinear filters: range and bearing of planar positions
+    B = 5
+    Ac = buildA(dt)[np.ix_([0,1,3,4,6,7],[0,1,3,4,6,7])]
+    f = lambda X: np.dot(Ac, X)
+    h = lambda X: np.vstack((np.hypot(X[0], X[1]), np.arctan2(X[1], X[0])))
+    t = np.arange(N)*dt
+    offsets = np.random.random((B,2))*10.0 + 5.0
+    true_pos = offsets[:,:,None] + np.array([np.cos(t), np.sin(t)])
+    Zn = np.array([h(true_pos[b]).T for b in range(B)]) + np.random.normal(0.0, [0.05, 0.005], (B,N,2))
+    x0 = np.hstack((offsets, np.zeros((B,4))))
+    Rn = np.diag([0.05, 0.005])**2
+    bank = UKFBank(x0, np.eye(6), f, h, np.eye(6)*1e-3, Rn)
+    single = UKF(x0[2], np.eye(6), f, h, np.eye(6)*1e-3, Rn)
+    X = np.array([bank.step(Zn[:,i])[0][:,:2] for i in range(N)])
+    X2 = np.array([single.step(Zn[2,i])[0][:2,0] for i in range(N)])
+    rmse = np.sqrt(np.mean((X[50:]-np.transpose(true_pos, (2,0,1))[50:])**2))
+    if debug:
+        print("----------------------------------------------------------------------")
+        print("Max. difference with kf =", np.max(abs(x_ukf-xhat)))
+        print("RMSE of bank of UKFs    =", rmse)
+    assertTest( np.allclose(x_ukf, xhat) and np.allclose(P_ukf, P) , "UKF with linear models")
+    assertTest( np.allclose(x_redraw, xhat) and np.allclose(P_redraw, P) , "UKF with linear models (redraw)")
+    # Random walk with large process noise
+    ukf_walk = UKF(np.zeros(1), np.eye(1), lambda X: X, lambda X: X, np.eye(1), np.eye(1), alpha=1.0)
+    xhat, P = np.zeros((1,1)), np.eye(1)
+    walk_diff = 0.0
+    for z in np.cumsum(np.random.normal(0.0, 1.0, N)):
+        xhat, P = kf(xhat, np.array([z]), np.eye(1), P, np.eye(1), np.eye(1), np.eye(1))
+        x_walk, P_walk = ukf_walk.step(z)
+        walk_diff = max(walk_diff, abs(x_walk[0,0]-xhat[0,0]))
+    assertTest( walk_diff < 1e-9 and np.allclose(P_walk, P) , "UKF with large process noise")
+    assertTest( np.allclose(X[:,2], X2) , "Bank of UKFs")
+    assertTest( rmse < 0.1 , "UKF with nonlinear measurements")
+
+
+def test_AxisKF(debug=False):
+    """
+    Test that the per-axis Kalman Filter gives the estimates of kf for the
+    constant acceleration model.
+    """
+    N, dt = 200, 0.01
+    A = buildA(dt)
+    H = np.hstack((np.eye(3), np.zeros((3,6))))
+    Q = buildQca(np.random.random(9), dt)
+    R = buildR(np.random.random(3))
+    Z = np.cumsum(np.random.normal(0.0, 0.1, (N,3)), axis=0)
+    axkf = AxisKF(np.zeros(9), np.eye(9), A, Q, R, H)
+    xhat, P = np.zeros((9,1)), np.eye(9)
+    max_diff = 0.0
+    for i in range(N):
+        xhat, P = kf(xhat, Z[i], A, P, Q, R, H)
+        max_diff = max(max_diff, np.max(abs(axkf.step(Z[i])-xhat)/(1.0+abs(xhat))))
+    coupled = Q.copy()
+    coupled[0,1] = coupled[1,0] = 1e-3
+    if debug:
+        print("----------------------------------------------------------------------")
+        print("Max. relative difference =", max_diff)
+    assertTest( max_diff < 1e-9 and np.allclose(axkf.Pfull, P) , "Per-axis Kalman Filter")
+    # Axes measured differently: an extra velocity row, or no z measurement
+    H_vel = np.vstack((H, np.eye(9)[4]))
+    R_vel = buildR(np.random.random(4))
+    assertTest( decouple(A, coupled, R, H) is None and decouple(A, Q, R_vel, H_vel) is None
+                and decouple(A, Q, R[:2,:2], H[:2]) is None , "Detection of coupled axes")
+
+
+def test_MultiTracker(debug=False):
+    """
+    Test the multi-target tracker with shuffled noisy detections of objects
+    moving at constant velocity, where some objects disappear.
+    """
+    T, N, dt = 200, 30, 0.1
+    A = buildA(dt)
+    H = np.hstack((np.eye(3), np.zeros((3,6))))
+    Q = buildQca(1e-2*np.ones(9), dt)
+    R = buildR(1e-2*np.ones(3))
+    pos = np.random.uniform(-100.0, 100.0, (T,3))
+    vel = np.random.normal(0.0, 1.0, (T,3))
+    P0 = np.diag([1e-2]*3 + [25.0]*3 + [1.0]*3)
+    for method in ['hungarian', 'gnn']:
+        tracker = MultiTracker(A, Q, R, H, P0, gate=0.99999, method=method)
+        labels = {}
+        for i in range(N):
+            # The last 20 objects vanish half way through
+            visible = T if i < N//2 else T-20
+            Z = pos[:visible] + vel[:visible]*dt*i + np.random.normal(0.0, 0.1, (visible,3))
+            shuffle = np.random.permutation(visible)
+            tracker.step(Z[shuffle])
+            slots = np.flatnonzero(tracker.alive)
+            # Label each track with its nearest object
+            true = pos + vel*dt*i
+            err = np.linalg.norm(tracker.X[slots,None,:3] - true[None,:,:], axis=2)
+            for slot, obj in zip(slots, np.argmin(err, axis=1)):
+                labels.setdefault(tracker.ids[slot], set()).add(obj)
+        ids, X = tracker.tracks()
+        true = pos[:T-20] + vel[:T-20]*dt*(N-1)
+        max_err = np.max(np.min(np.linalg.norm(X[:,None,:3]-true[None], axis=2), axis=1))
+        if debug:
+            print("----------------------------------------------------------------------")
+            print(method, ": confirmed tracks =", len(ids), ", max. position error =", max_err)
+        assertTest( len(ids) == T-20 and max_err < 0.5 and all(len(v) == 1 for v in labels.values()) ,
+                    "Multi-target tracking (" + method + ")")
+
+
+def test_KalmanFilter(debug=False):
+    """
+    Test that the in-place Kalman Filter gives the estimates of kf and that,
+    once running, its steps allocate no memory: the traced memory does not
+    grow and its peak stays below the size of a single covariance matrix.
+    """
+    N, dt = 1000, 0.01
+    A = buildA(dt)
+    H = np.hstack((np.eye(3), np.zeros((3,6))))
+    Q = buildQca(np.random.random(9), dt)
+    R = buildR(np.random.random(3))
+    Z = np.random.normal(0.0, 1.0, (N,3))
+    kfo = KalmanFilter(np.zeros(9), np.eye(9), A, Q, R, H)
+    xhat, P = np.zeros((9,1)), np.eye(9)
+    for i in range(100):
+        kfo.step(Z[i])
+        xhat, P = kf(xhat, Z[i], A, P, Q, R, H)
+    assertTest( np.allclose(kfo.xhat, xhat) and np.allclose(kfo.P, P) , "Kalman Filter object")
+    # Rows of Z are taken beforehand to trace only the steps
+    rows = list(Z)
+    tracemalloc.start()
+    for z in rows[:100]:
+        kfo.step(z)
+    size = {}
+    # An empty step measures what the loop itself leaves allocated
+    steps = [('empty', lambda z: None), ('KalmanFilter', kfo.step), ('kf', lambda z: kf(xhat, z, A, P, Q, R, H))]
+    for name, step in steps:
+        current = tracemalloc.get_traced_memory()[0]
+        tracemalloc.reset_peak()
+        for z in rows:
+            step(z)
+        now, peak = tracemalloc.get_traced_memory()
+        size[name] = (now-current, peak-current)
+    tracemalloc.stop()
+    if debug:
+        print("----------------------------------------------------------------------")
+        for name in size:
+            print("%-12s: %d bytes left after %d steps, peak of %d bytes" % ((name, size[name][0], N, size[name][1])))
+    assertTest( size['KalmanFilter'][0] <= size['empty'][0] and size['KalmanFilter'][1] < P.nbytes , "No allocations per step")
+
+
+def test_Sweep(debug=False):
+    """
+    Test the sweep of noise parameters against single runs of kf, in a pool of
+    processes and with early stops. The measurements are simulated with one
+    of the cells, whose average NIS must be close to 1.
+    """
+    N, dt = 1000, 0.01
+    A = buildA(dt)
+    H = np.hstack((np.eye(3), np.zeros((3,6))))
+    Qs = [buildQca(q*np.ones(9), dt) for q in np.logspace(-3, 2, 6)]
+    Rs = [buildR(r*np.ones(3)) for r in np.logspace(-4, 0, 5)]
+    # Simulated trajectory with the noises of cell (3,2)
+    w, V = np.linalg.eigh(Qs[3])
+    L = V*np.sqrt(np.clip(w, 0.0, None))
+    X = np.zeros((N,9))
+    x = np.zeros(9)
+    for i in range(N):
+        x = np.dot(A, x) + np.dot(L, np.random.normal(0.0, 1.0, 9))
+        X[i] = x
+    Z = np.dot(X, H.T) + np.random.normal(0.0, np.sqrt(Rs[2][0,0]), (N,3))
+    table = kfSweep(Z, A, H, Qs, Rs, np.zeros(9), np.eye(9), truth=X, block=8)
+    # A single cell run with kf
+    xhat, P = np.zeros((9,1)), np.eye(9)
+    err = 0.0
+    for i in range(N):
+        xhat, P = kf(xhat, Z[i], A, P, Qs[1], Rs[4], H)
+        err += np.sum((X[i]-xhat[:,0])**2)/9
+    cell = table[(table['q'] == 1) & (table['r'] == 4)][0]
+    true_cell = table[(table['q'] == 3) & (table['r'] == 2)][0]
+    pooled = kfSweep(Z, A, H, Qs, Rs, np.zeros(9), np.eye(9), truth=X, workers=2, block=8)
+    stopped = kfSweep(Z, A, H, Qs, Rs, np.zeros(9), np.eye(9), truth=X, stop=3.0)
+    stopped_true = stopped[(stopped['q'] == 3) & (stopped['r'] == 2)][0]
+    if debug:
+        print("----------------------------------------------------------------------")
+        print("NIS of true cell =", true_cell['nis'], ", NEES =", true_cell['nees'])
+        print("Cells stopped early:", np.count_nonzero(stopped['steps'] < N), "of", len(stopped))
+    assertTest( np.isclose(cell['rmse'], np.sqrt(err/N)) , "Sweep against kf")
+    assertTest( abs(true_cell['nis']-1.0) < 0.2 , "Consistent NIS of the true noises")
+    assertTest( np.allclose(pooled['rmse'], table['rmse']) and np.allclose(pooled['nees'], table['nees']) ,
+                "Sweep in a pool of processes")
+    assertTest( stopped_true['steps'] == N and np.any(stopped['steps'] < N) , "Early stop of inconsistent cells")
+
+
+def test_FusionScheduler(debug=False):
+    """
+    Test the fusion of position (10 Hz), velocity (50 Hz) and acceleration
+    (100 Hz) measurements pushed out of order, against kf predicting at each
+    timestamp and updating with the rows of the reporting sensors.
+    """
+    qc = np.ones(9)*0.1
+    I3, O3 = np.eye(3), np.zeros((3,3))
+    sensors = {'pos': (np.hstack((I3, O3, O3)), buildR(np.ones(3)*1e-2)),
+               'vel': (np.hstack((O3, I3, O3)), buildR(np.ones(3)*1e-3)),
+               'acc': (np.hstack((O3, O3, I3)), buildR(np.ones(3)*1e-1))}
+    rates = {'pos': 10, 'vel': 50, 'acc': 100}
+    events = [(round(k/float(f), 6), name, np.random.normal(0.0, 1.0, 3))
+              for name, f in rates.items() for k in range(1, f+1)]
+    fusion = FusionScheduler(np.zeros(9), np.eye(9), sensors, qc=qc)
+    for i in np.random.permutation(len(events)):
+        fusion.push(*events[i])
+    mid_x, _ = fusion.state(0.505)
+    xhat, P = fusion.process()
+    # Reference: kf at each timestamp, sensors in the order they were pushed
+    events.sort(key=lambda e: e[0])
+    disc = Discretizer(qc)
+    x_ref, P_ref, t_ref = np.zeros((9,1)), np.eye(9), 0.0
+    for t, name, z in events:
+        A, Q = disc(t - t_ref)
+        if t > t_ref:
+            x_ref, P_ref = np.dot(A, x_ref), np.dot(A, np.dot(P_ref, A.T)) + Q
+            t_ref = t
+        H, R = sensors[name]
+        x_ref, P_ref = kfUpdate(x_ref, z.reshape((3,1)) - np.dot(H, x_ref), P_ref, R, H)
+    stamps = len(set(e[0] for e in events))
+    if debug:
+        print("----------------------------------------------------------------------")
+        print(len(events), "measurements fused with", fusion.predictions, "predictions")
+    assertTest( np.allclose(xhat, x_ref) and np.allclose(P, P_ref) , "Multi-rate fusion")
+    assertTest( fusion.predictions == stamps and mid_x.shape == (9,1) , "One prediction per timestamp")
+    fusion.push(0.5, 'pos', np.zeros(3))
+    fusion.process()
+    assertTest( fusion.late == 1 and np.allclose(fusion.xhat, xhat) , "Late measurements dropped")
+    try:
+        FusionScheduler(np.zeros(9), np.eye(9), sensors)
+        missing = False
+    except ValueError:
+        missing = True
+    assertTest( missing , "Missing process noise")
+
+
+def test_InformationFilter(debug=False):
+    """
+    Test the Information Filter fusing 30 position sensors against kf with
+    all sensors stacked, and the Extended Information Filter with range
+    sensors against ekf.
+    """
+    S, N, dt = 30, 50, 0.01
+    A = buildA(dt)
+    Q = buildQca(np.ones(9), dt)
+    Hs = np.hstack((np.eye(3), np.zeros((3,6))))
+    sensors = dict(("s%02d" % i, (Hs, buildR(np.random.random(3)))) for i in range(S))
+    names = sorted(sensors)
+    H = np.vstack([sensors[s][0] for s in names])
+    R = lin.block_diag(*[sensors[s][1] for s in names])
+    Z = np.random.normal(0.0, 1.0, (N,3*S))
+    info = InformationFilter(np.zeros(9), np.eye(9), A, Q, sensors)
+    xhat, P = np.zeros((9,1)), np.eye(9)
+    t_info = t_kf = 0.0
+    for i in range(N):
+        zs = dict((s, Z[i,3*k:3*k+3]) for k, s in enumerate(names))
+        t = time.time()
+        info.step(zs)
+        t_info += time.time()-t
+        t = time.time()
+        xhat, P = kf(xhat, Z[i], A, P, Q, R, H)
+        t_kf += time.time()-t
+    if debug:
+        print("----------------------------------------------------------------------")
+        print("%d sensors: %.1f us/step (information) vs %.1f us/step (kf)" % (S, t_info/N*1e6, t_kf/N*1e6))
+    assertTest( np.allclose(info.xhat, xhat) and np.allclose(info.P, P) , "Information Filter")
+    # Range sensors to beacons with a random walk in the plane
+    beacons = np.random.uniform(-10.0, 10.0, (5,2))
+    f = lambda X: X
+    ranges = dict(("b%d" % i, (lambda X, b=b: np.sqrt(np.sum((X-b.reshape((2,1)))**2, axis=0, keepdims=True)), [[0.01]]))
+                  for i, b in enumerate(beacons))
+    eif = ExtendedInformationFilter(np.zeros(2), np.eye(2), f, 0.01*np.eye(2), ranges)
+    h = lambda X: np.vstack([ranges[s][0](X) for s in sorted(ranges)])
+    xhat, P = np.zeros((2,1)), np.eye(2)
+    x = np.zeros(2)
+    for i in range(N):
+        x = x + np.random.normal(0.0, 0.1, 2)
+        z = h(x.reshape((2,1)))[:,0] + np.random.normal(0.0, 0.1, len(beacons))
+        eif.step(dict((s, z[k]) for k, s in enumerate(sorted(ranges))))
+        xhat, P = ekf(xhat, z, f, P, 0.01*np.eye(2), 0.01*np.eye(len(beacons)), h)
+    assertTest( np.allclose(eif.xhat, xhat) and np.allclose(eif.P, P) , "Extended Information Filter")
+
+
+def bench_Update(N=100000):
+    """
+    Compare the latency per step of the update methods of the Kalman Filter
+    and the drift of their covariance after N steps: its asymmetry and its
+    smallest eigenvalue (negative values mean P is no longer positive
+    definite). Run it with N=10**7 to check long runs.
+    """
+    dt = 0.001
+    A = buildA(dt)
+    H = np.hstack((np.eye(3), np.zeros((3,6))))
+    Q = buildQ(np.ones(9)*1e-6, buildF(dt), dt)
+    Q = 0.5*(Q+Q.T)
+    R = buildR(np.ones(3)*1e-4)
+    Z = np.random.normal(0.0, 0.01, (N,3))
+    print("Running %d steps of the Kalman Filter:" % N)
+    for method in ['inv', 'cholesky', 'sequential']:
+        xhat, P = np.zeros((9,1)), np.eye(9)
+        t = time.time()
+        for i in range(N):
+            xhat, P = kf(xhat, Z[i], A, P, Q, R, H, method)
+        t = (time.time()-t)/N
+        asym = np.max(abs(P-P.T))
+        min_eig = np.min(np.linalg.eigvals(0.5*(P+P.T)).real)
+        print("  %-10s %7.2f us/step   asymmetry = %1.2e   min. eigenvalue = %1.2e" % (method, t*1e6, asym, min_eig))
 
 
 ## MAIN EXECUTION as a script ##
 if __name__ == "__main__":
     import sys
-    
+
     # Default values
     dmode = False       # Debug mode is OFF
 
     # Read extra parameters (if given)
     if len(sys.argv) == 2:
-        print "This script is not yet fully customizable"
\ No newline at end of file
+        if sys.argv[1] == "--debug":
+            dmode = True
+            print(bcolors.ENBL+"Debug mode is ON"+bcolors.ENDC)
+        elif sys.argv[1] == "--bench":
+            bench_Update()
+            sys.exit()
+        else:
+            print("This script is not yet fully customizable")
+
+    # Start Running Tests in given mode
+    print("Running tests... ")
+    test_KalmanBank(debug=dmode)
+    test_SteadyState(debug=dmode)
+    test_Update(debug=dmode)
+    test_SquareRoot(debug=dmode)
+    test_Smoother(debug=dmode)
+    test_Discretizer(debug=dmode)
+    test_EKF(debug=dmode)
+    test_UKF(debug=dmode)
+    test_AxisKF(debug=dmode)
+    test_MultiTracker(debug=dmode)
+    test_KalmanFilter(debug=dmode)
+    test_Sweep(debug=dmode)
+    test_FusionScheduler(debug=dmode)
+    test_InformationFilter(debug=dmode)